@@ -1,12 +1,16 @@
-def agent_diagnostiqueur(reference: str, panne: str) -> str:
-    """Agent 1: Diagnostiqueur électrique via Perplexity."""
-    product = get_product_by_ref(reference)
+from agents import precalcul
+from utils.somfy_database import get_product_by_ref
+from utils.upstream import call_perplexity
+
+
+def prompt_diagnostic(reference: str, product: dict, panne: str = "") -> str:
+    """Sans description de panne : check-list générique du produit (précalculable)."""
     product_name = product['name'] if product else "produit inconnu"
-    
-    prompt = f"""Tu es un électricien expert Somfy tertiaire avec 20 ans d'expérience.
+    contexte = f"Panne décrite: {panne}" if panne else "Aucune panne précise : check-list de diagnostic générique du produit."
+    return f"""Tu es un électricien expert Somfy tertiaire avec 20 ans d'expérience.
 
 Produit: {product_name} (ref {reference})
-Panne décrite: {panne}
+{contexte}
 
 Génère un DIAGNOSTIC ÉLECTRIQUE COMPLET avec:
 
@@ -46,5 +50,22 @@ Génère un DIAGNOSTIC ÉLECTRIQUE COMPLET avec:
    - Recommandations de sécurité
 
 Format: clair, numéroté, professionnel, pour électricien sur site."""
+
+
+precalcul.enregistrer("checklist", prompt_diagnostic)
+
+
+async def agent_diagnostiqueur(reference: str, panne: str, product: dict = None) -> str:
+    """Agent 1: Diagnostiqueur électrique via Perplexity."""
+    product = product or get_product_by_ref(reference)
     
-    return call_perplexity(prompt)
+    if product and not panne.strip():
+        diagnostic = await precalcul.obtenir("checklist", reference, product)
+    else:
+        try:
+            diagnostic = await call_perplexity(prompt_diagnostic(reference, product, panne))
+        except Exception:
+            # Fournisseur indisponible : la check-list générique déjà calculée reste utile sur site
+            diagnostic = precalcul.existant("checklist", reference) if product else None
+            if diagnostic is None: raise
+    return f"## 🩺 AGENT 1 - DIAGNOSTIC ÉLECTRIQUE\n\n{diagnostic}"
@@ -1,11 +1,9 @@
-def agent_documenteur(reference: str) -> str:
-    """Agent 3: Documenteur (Perplexity + PDF Somfy)."""
-    product = get_product_by_ref(reference)
-    
-    if not product:
-        return f"❌ Aucune documentation trouvée pour référence {reference}"
-    
-    prompt = f"""Tu es un formateur Somfy certifié pour installateurs électriciens tertiaire.
+from agents import precalcul
+from utils.somfy_database import get_product_by_ref
+
+
+def prompt_procedure(reference: str, product: dict) -> str:
+    return f"""Tu es un formateur Somfy certifié pour installateurs électriciens tertiaire.
 
 Produit: {product['name']} (ref {reference})
 
@@ -82,8 +80,19 @@ Génère une PROCÉDURE DÉTAILLÉE ET COMPLÈTE de mise en service avec:
   * Nettoyage boîtier si nécessaire
 
 Format: clair, étape par étape, professionnel, pour électricien tertiaire."""
+
+
+precalcul.enregistrer("procedure", prompt_procedure)
+
+
+async def agent_documenteur(reference: str, product: dict = None) -> str:
+    """Agent 3: Documenteur (Perplexity + PDF Somfy), procédure servie depuis le précalcul."""
+    product = product or get_product_by_ref(reference)
+    
+    if not product:
+        return f"❌ Aucune documentation trouvée pour référence {reference}"
     
-    procedure = call_perplexity(prompt)
+    procedure = await precalcul.obtenir("procedure", reference, product)
     
     # Ajouter les liens PDF Somfy
     docs = "\n### 📄 Notices officielles Somfy\n"
@@ -1,9 +1,12 @@
-def agent_somfy_specialist(reference: str) -> str:
+from utils.somfy_database import get_product_by_ref, list_references
+
+
+async def agent_somfy_specialist(reference: str, product: dict = None) -> str:
     """Agent 2: Spécialiste Somfy (base de données)."""
-    product = get_product_by_ref(reference)
+    product = product or get_product_by_ref(reference)
     
     if not product:
-        available = ", ".join(SOMFY_PRODUCTS.keys())
+        available = ", ".join(list_references())
         return f"❌ Référence {reference} non trouvée.\n\nRéférences disponibles: {available}"
     
     return f"""## 🔧 AGENT 2 - SPÉCIALISTE SOMFY
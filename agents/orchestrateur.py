@@ -0,0 +1,49 @@
+"""Orchestrateur : résout le produit une fois puis lance les trois agents en parallèle."""
+import asyncio
+import logging
+import os
+
+from agents.agent_diagnostiqueur import agent_diagnostiqueur
+from agents.agent_documenteur import agent_documenteur
+from agents.agent_somfy_specialist import agent_somfy_specialist
+from utils import metrics
+from utils.somfy_database import get_product_by_ref
+
+logger = logging.getLogger(__name__)
+
+# Délai propre à chaque agent (s) : un agent lent ne retient que sa propre section
+AGENT_TIMEOUTS = {
+    "specialiste": float(os.environ.get("AGENT_SPECIALISTE_TIMEOUT", "2")),
+    "diagnostiqueur": float(os.environ.get("AGENT_DIAGNOSTIQUEUR_TIMEOUT", "30")),
+    "documenteur": float(os.environ.get("AGENT_DOCUMENTEUR_TIMEOUT", "45")),
+}
+AGENT_TITLES = {
+    "specialiste": "🔧 AGENT 2 - SPÉCIALISTE SOMFY",
+    "diagnostiqueur": "🩺 AGENT 1 - DIAGNOSTIC ÉLECTRIQUE",
+    "documenteur": "📚 AGENT 3 - DOCUMENTATION & PROCÉDURES",
+}
+
+
+async def run_agent(name: str, coro) -> str:
+    """Exécute un agent dans son délai ; en cas d'échec, rend une section explicite au lieu de tout perdre."""
+    timeout = AGENT_TIMEOUTS[name]
+    try:
+        with metrics.stage(f"agent_{name}"):
+            return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Agent %s : délai de %g s dépassé", name, timeout)
+        return f"## ⏱️ {AGENT_TITLES[name]}\nSection indisponible : délai de {timeout:g} s dépassé."
+    except Exception as e:
+        logger.warning("Agent %s en erreur : %s", name, e)
+        return f"## ⚠️ {AGENT_TITLES[name]}\nSection indisponible : {e}"
+
+
+async def orchestrer(reference: str, panne: str) -> str:
+    """Rapport fusionné (markdown ##) : la latence totale est celle de l'agent le plus lent."""
+    product = get_product_by_ref(reference)
+    sections = await asyncio.gather(
+        run_agent("specialiste", agent_somfy_specialist(reference, product)),
+        run_agent("diagnostiqueur", agent_diagnostiqueur(reference, panne, product)),
+        run_agent("documenteur", agent_documenteur(reference, product)),
+    )
+    return "\n\n".join(sections)
@@ -0,0 +1,171 @@
+"""Précalcul des contenus qui ne dépendent que du produit (procédures du documenteur, check-lists du diagnostiqueur).
+
+Chaque agent enregistre la fonction qui construit son prompt ; le contenu généré est stocké avec l'empreinte du
+prompt et de la fiche produit, si bien qu'une modification de l'un ou de l'autre le rend périmé. Une tâche de fond
+balaie le catalogue à débit limité ; une entrée absente ou périmée est calculée à la demande.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.singleflight import SingleFlight
+from utils.upstream import call_perplexity
+
+logger = logging.getLogger(__name__)
+
+PRECALCUL_DB = os.environ.get("PRECALCUL_DB", "data/precalcul.db")
+# Débit des générations de fond (0 = pas de précalcul, calcul à la demande seulement)
+PRECALCUL_RPM = float(os.environ.get("PRECALCUL_RPM", "4"))
+# Âge (s) au-delà duquel un contenu est régénéré en tâche de fond (il reste servi en attendant)
+PRECALCUL_REFRESH = float(os.environ.get("PRECALCUL_REFRESH", str(7 * 86400)))
+# Intervalle (s) entre deux balayages du catalogue
+PRECALCUL_POLL = float(os.environ.get("PRECALCUL_POLL", "900"))
+ON_DEMAND_TIMEOUT = 120.0
+
+PROMPTS = {}  # type de contenu -> fonction(référence, produit) -> prompt
+store = None  # PrecalculStore ouvert par l'application ; None = génération directe à chaque appel
+_flights = SingleFlight()
+STATS = {"hits": 0, "stale_hits": 0, "on_demand": 0, "generated": 0, "errors": 0}
+
+
+def enregistrer(kind: str, prompt_fn):
+    PROMPTS[kind] = prompt_fn
+
+
+def empreinte(value) -> str:
+    data = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+class PrecalculStore:
+    """Contenus générés par (type, référence), avec version du prompt, empreinte produit et date."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS precalcul (
+                kind TEXT, reference TEXT, content TEXT, prompt_version TEXT, product_hash TEXT, created REAL,
+                PRIMARY KEY (kind, reference)
+            )""")
+        self._db.commit()
+
+    def get(self, kind: str, reference: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content, prompt_version, product_hash, created FROM precalcul WHERE kind = ? AND reference = ?",
+                (kind, reference)).fetchone()
+        if not row: return None
+        return dict(zip(("content", "prompt_version", "product_hash", "created"), row))
+
+    def put(self, kind: str, reference: str, content: str, prompt_version: str, product_hash: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO precalcul VALUES (?, ?, ?, ?, ?, ?)",
+                             (kind, reference, content, prompt_version, product_hash, time.time()))
+            self._db.commit()
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT kind, COUNT(*) FROM precalcul GROUP BY kind"))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def etat(entry, prompt: str, product: dict) -> str:
+    """« absent », « périmé » (prompt ou fiche modifiés), « ancien » (à rafraîchir) ou « frais »."""
+    if entry is None: return "absent"
+    if entry["prompt_version"] != empreinte(prompt) or entry["product_hash"] != empreinte(product): return "périmé"
+    if time.time() - entry["created"] > PRECALCUL_REFRESH: return "ancien"
+    return "frais"
+
+
+async def generer(kind: str, reference: str, product: dict) -> str:
+    prompt = PROMPTS[kind](reference, product)
+    content = await call_perplexity(prompt)
+    if store is not None:
+        store.put(kind, reference, content, empreinte(prompt), empreinte(product))
+    STATS["generated"] += 1
+    return content
+
+
+async def _generer_une_fois(kind: str, reference: str, product: dict) -> str:
+    # Demandes simultanées (ou balayage en cours) pour la même entrée : une seule génération
+    content, _ = await _flights.do(f"{kind}:{reference}", lambda: generer(kind, reference, product), ON_DEMAND_TIMEOUT)
+    return content
+
+
+async def obtenir(kind: str, reference: str, product: dict) -> str:
+    """Contenu précalculé si disponible (même ancien), sinon généré immédiatement et stocké."""
+    prompt = PROMPTS[kind](reference, product)
+    if store is None: return await call_perplexity(prompt)
+    entry = store.get(kind, reference)
+    state = etat(entry, prompt, product)
+    if state in ("frais", "ancien"):
+        STATS["hits" if state == "frais" else "stale_hits"] += 1
+        return entry["content"]
+    STATS["on_demand"] += 1
+    try:
+        return await _generer_une_fois(kind, reference, product)
+    except Exception:
+        # Fiche ou prompt modifiés mais fournisseur indisponible : l'ancienne version vaut mieux que rien
+        if entry is not None: return entry["content"]
+        raise
+
+
+def existant(kind: str, reference: str):
+    """Contenu stocké tel quel (sans génération), ou None."""
+    entry = store.get(kind, reference) if store is not None else None
+    return entry["content"] if entry else None
+
+
+class Precalculateur:
+    """Balaye périodiquement les références et régénère, à débit limité, ce qui est absent, périmé ou ancien."""
+
+    def __init__(self, references, get_product, limiter, poll: float = PRECALCUL_POLL, delay: float = 10.0):
+        self.references = references
+        self.get_product = get_product
+        self.limiter = limiter
+        self.poll = poll
+        self.delay = delay
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._boucle())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _boucle(self):
+        await asyncio.sleep(self.delay)
+        while True:
+            await self.balayer()
+            await asyncio.sleep(self.poll)
+
+    async def balayer(self):
+        for reference in list(self.references()):
+            product = self.get_product(reference)
+            if not product: continue
+            for kind, prompt_fn in PROMPTS.items():
+                if etat(store.get(kind, reference), prompt_fn(reference, product), product) == "frais": continue
+                if self.limiter: await self.limiter.acquire()
+                try:
+                    await _generer_une_fois(kind, reference, product)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    STATS["errors"] += 1
+                    logger.warning("Précalcul %s %s en échec : %s", kind, reference, e)
+
+
+def stats() -> dict:
+    return {**STATS, "stored": store.counts() if store is not None else {}}
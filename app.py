@@ -1,86 +1,406 @@
 import os
+import json
 import re
 import base64
+import asyncio
+import logging
+import time
+from html import escape
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import httpx
-from fastapi import FastAPI, UploadFile, Form, File
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, UploadFile, Form, File, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from groq import Groq
+from starlette.background import BackgroundTask
+from groq import AsyncGroq
 from dotenv import load_dotenv
+from utils.cache import DiagnosticCache, cache_key
+from utils import images, metrics, upstream
+from utils.images import ImageRejetee
+from utils.admission import AdmissionController, Surcharge, RAPIDE, COMPLET, FOND
+from utils.singleflight import SingleFlight
+from utils.static import StaticAsset
+from utils.cases import CaseBase
+from utils.jobs import IncompleteReport, JobStore, JobScheduler, parse_batch, ticket_description, ticket_image
+from utils.upstream import TokenBucket
+from agents import precalcul
+from agents.orchestrateur import orchestrer
+from agents.agent_somfy_specialist import agent_somfy_specialist
+from utils.somfy_database import SOMFY_PRODUCTS, get_product_by_ref
 
 load_dotenv()
+logger = logging.getLogger("somfy_app")
 
 # --- CONFIGURATION ET BASE ---
 try:
-    import somfy_database as db
-    BASE_TECHNIQUE = str(db.SOMFY_PRODUCTS)
+    from utils import retrieval
     NOM_PROJET = "Somfy Expert AI"
 except Exception as e:
-    BASE_TECHNIQUE = "{}"
+    retrieval = None
     NOM_PROJET = "Diagnostic Pro"
+# Nombre de fiches produit injectées dans le prompt
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "3"))
 
-app = FastAPI()
+# --- CLIENTS HTTP PARTAGÉS (pool keep-alive) ---
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "10"))
+# Cache des rapports rendus (DIAG_CACHE_SIZE=0 le désactive, DIAG_CACHE_PATH active la persistance SQLite)
+DIAG_CACHE_SIZE = int(os.environ.get("DIAG_CACHE_SIZE", "512"))
+DIAG_CACHE_TTL = float(os.environ.get("DIAG_CACHE_TTL", "86400"))
+DIAG_CACHE_PATH = os.environ.get("DIAG_CACHE_PATH", "")
+# Préparation des photos (hors boucle d'événements)
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", "15"))
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1568"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# Diagnostics en lot : file persistante, concurrence et débits propres aux campagnes (0 = pas de limite)
+JOBS_DB = os.environ.get("JOBS_DB", "data/jobs.db")
+JOBS_CONCURRENCY = int(os.environ.get("JOBS_CONCURRENCY", "4"))
+JOBS_GROQ_RPM = float(os.environ.get("JOBS_GROQ_RPM", "20"))
+JOBS_PERPLEXITY_RPM = float(os.environ.get("JOBS_PERPLEXITY_RPM", "20"))
+# Base de cas : réponse directe au-delà de CASE_DIRECT_MIN (cas validé), pistes pour le prompt au-delà de CASE_CONTEXT_MIN
+CASES_DB = os.environ.get("CASES_DB", "data/cases.db")
+CASE_DIRECT_MIN = float(os.environ.get("CASE_DIRECT_MIN", "0.85"))
+CASE_CONTEXT_MIN = float(os.environ.get("CASE_CONTEXT_MIN", "0.35"))
+CASE_CONTEXT_K = int(os.environ.get("CASE_CONTEXT_K", "2"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crée une seule fois les clients Groq / Perplexity, réutilisés par toutes les requêtes."""
+    limits = httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE)
+    app.state.http = httpx.AsyncClient(limits=limits, timeout=25.0)
+    upstream.http_client = app.state.http
+    groq_key = os.environ.get("GROQ_API_KEY")
+    # Les reprises sont gérées par utils.upstream (backoff, disjoncteur) : pas de reprises internes au SDK
+    app.state.groq = AsyncGroq(api_key=groq_key, http_client=httpx.AsyncClient(limits=limits), max_retries=0) if groq_key else None
+    app.state.cache = DiagnosticCache(DIAG_CACHE_SIZE, DIAG_CACHE_TTL, DIAG_CACHE_PATH or None)
+    app.state.static = build_static()
+    app.state.flights = SingleFlight()
+    app.state.admission = AdmissionController(ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_DEADLINE)
+    app.state.enrichments = {}
+    app.state.image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+    app.state.jobs = JobStore(JOBS_DB)
+    app.state.cases = CaseBase(CASES_DB)
+    # Rafale = concurrence : un lot démarre avec tous ses workers, le débit moyen reste borné par les RPM
+    app.state.scheduler = JobScheduler(
+        app.state.jobs, run_job, JOBS_CONCURRENCY,
+        {"groq": TokenBucket.per_minute(JOBS_GROQ_RPM, JOBS_CONCURRENCY),
+         "perplexity": TokenBucket.per_minute(JOBS_PERPLEXITY_RPM, JOBS_CONCURRENCY)},
+        job_providers
+    )
+    app.state.scheduler.start()
+    precalcul.store = precalcul.PrecalculStore(precalcul.PRECALCUL_DB)
+    limiter = TokenBucket.per_minute(precalcul.PRECALCUL_RPM)
+    app.state.precalcul = precalcul.Precalculateur(lambda: SOMFY_PRODUCTS, get_product_by_ref, limiter)
+    # PRECALCUL_RPM=0 : pas de balayage de fond, les entrées manquantes restent calculées à la demande
+    if limiter and os.environ.get("PERPLEXITY_API_KEY"): app.state.precalcul.start()
+    lag_watcher = asyncio.create_task(metrics.watch_loop_lag())
+    try:
+        yield
+    finally:
+        lag_watcher.cancel()
+        await app.state.scheduler.stop()
+        await app.state.precalcul.stop()
+        precalcul.store.close()
+        precalcul.store = None
+        app.state.jobs.close()
+        app.state.cases.close()
+        app.state.image_pool.shutdown(wait=False, cancel_futures=True)
+        app.state.cache.close()
+        if app.state.groq: await app.state.groq.close()
+        await app.state.http.aclose()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """Histogramme par route et en-tête Server-Timing (étapes terminées avant l'envoi des en-têtes)."""
+    timings = metrics.begin_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = getattr(request.scope.get("route"), "path", "autre")
+    metrics.REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing(timings + [("total", elapsed)])
+    return response
+
+@app.exception_handler(ImageRejetee)
+async def image_rejetee(request: Request, exc: ImageRejetee):
+    return HTMLResponse(content=format_html_output(f"## ⚠️ Photo refusée\n{exc}"), status_code=exc.status_code)
+
+@app.exception_handler(Surcharge)
+async def surcharge(request: Request, exc: Surcharge):
+    return HTMLResponse(content=format_html_output(f"## ⏳ Serveur saturé\n{exc}"), status_code=exc.status_code,
+                        headers={"Retry-After": str(exc.retry_after)})
+
 # --- ROUTES PWA ---
+def build_static() -> dict:
+    """Coque HTML, manifeste et service worker rendus une seule fois, compressés et étiquetés (ETag)."""
+    shell = StaticAsset(render_shell().encode(), "text/html; charset=utf-8", "no-cache")
+    with open("manifest.json", "rb") as f:
+        manifest = StaticAsset(f.read(), "application/manifest+json", "public, max-age=86400")
+    with open("sw.js", encoding="utf-8") as f:
+        # La version du cache du service worker suit l'empreinte de la coque
+        sw = StaticAsset(f.read().replace("__VERSION__", shell.etag.strip('"')[:12]).encode(),
+                         "application/javascript", "no-cache")
+    return {"/": shell, "/manifest.json": manifest, "/sw.js": sw}
+
 @app.get("/manifest.json")
-async def get_manifest():
-    return FileResponse("manifest.json")
+async def get_manifest(request: Request):
+    return app.state.static["/manifest.json"].response(request)
 
 @app.get("/sw.js")
-async def get_sw():
-    return FileResponse("sw.js", media_type="application/javascript")
+async def get_sw(request: Request):
+    return app.state.static["/sw.js"].response(request)
 
 # --- MOTEUR DE RECHERCHE WEB (Perplexity) ---
+WEB_UNAVAILABLE = "Recherche web indisponible."
+WEB_TIMEOUT = "Recherche web : délai dépassé."
+WEB_SUSPENDED = "Recherche web suspendue : Perplexity est en échec répété, nouvel essai automatique sous peu."
+# Résultats web qui rendent un rapport incomplet (jamais mis en cache)
+WEB_FAILURES = (WEB_UNAVAILABLE, WEB_TIMEOUT, WEB_SUSPENDED)
+
 async def search_perplexity(query: str):
-    api_key = os.environ.get("PERPLEXITY_API_KEY")
-    if not api_key: return ""
-    url = "https://api.perplexity.ai/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {
-        "model": "sonar-pro",
-        "messages": [
-            {"role": "system", "content": "Expert technique Somfy. Donne des solutions précises, schémas ou codes erreurs. Sois concis et utilise le gras."},
-            {"role": "user", "content": query}
-        ]
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.post(url, json=data, headers=headers, timeout=25.0)
-            return res.json()['choices'][0]['message']['content']
-        except: return "Recherche web indisponible."
+    if not os.environ.get("PERPLEXITY_API_KEY"): return ""
+    try:
+        with metrics.stage("perplexity"):
+            return await upstream.call_perplexity(query)
+    except upstream.CircuitOpenError: return WEB_SUSPENDED
+    except Exception: return WEB_UNAVAILABLE
 
 # --- FORMATAGE HTML ---
+def format_section(chunk: str) -> str:
+    """Rend une section ## (titre sur la première ligne) en bloc diag-section ; le texte (sortie du modèle, saisie,
+    base de cas) est échappé : seul le gabarit est du HTML."""
+    c = chunk.replace("**", "").strip()
+    if not c: return ""
+    lines = c.split('\n')
+    title = escape(lines[0].strip().lstrip("#").strip())
+    return section_html(title, "<br>".join(escape(line) for line in lines[1:]).strip())
+
+def section_html(title: str, body: str) -> str:
+    """Bloc diag-section à partir d'un titre et d'un corps déjà en HTML."""
+    css = "diag-section"
+    icon = "⚙️"
+    if "Identification" in title: icon, css = "🆔", "diag-section"
+    elif "Analyse" in title: icon, css = "🔍", "diag-section s-analyse"
+    elif "Correction" in title: icon, css = "🛠️", "diag-section s-fix"
+    elif "Base" in title or "Enrichissement" in title: icon, css = "💾", "diag-section s-data"
+    return f"<div class='{css}'><div class='section-header'>{icon} {title}</div><div class='section-body'>{body}</div></div>"
+
+def format_web_block(web_info: str) -> str:
+    if not web_info: return ""
+    web_body = escape(web_info).replace("**", "<b>").replace("\n", "<br>")
+    return f"<div class='diag-section s-web'><div class='section-header'>🌐 SOLUTIONS WEB TEMPS RÉEL</div><div class='section-body'>{web_body}</div></div>"
+
+def parse_sections(text: str, web_info: str = "") -> list:
+    """Sections du rapport, découpées comme dans format_html_output : [{"title", "body"}]."""
+    sections = []
+    for chunk in re.split(r'##', text.replace("###", "##")):
+        lines = chunk.replace("**", "").strip().split('\n')
+        if lines[0]: sections.append({"title": lines[0].strip(), "body": "\n".join(lines[1:]).strip()})
+    if web_info: sections.append({"title": "Solutions web temps réel", "body": web_info})
+    return sections
+
 def format_html_output(text: str, web_info: str = "") -> str:
-    clean = text.replace("**", "").replace("###", "##")
+    clean = text.replace("###", "##")
     sections = re.split(r'##', clean)
-    html_res = ""
-    for s in sections:
-        c = s.strip()
-        if not c: continue
-        lines = c.split('\n')
-        title = lines[0].strip()
-        body = "<br>".join(lines[1:]).strip()
-        css = "diag-section"
-        icon = "⚙️"
-        if "Identification" in title: icon, css = "🆔", "diag-section"
-        elif "Analyse" in title: icon, css = "🔍", "diag-section s-analyse"
-        elif "Correction" in title: icon, css = "🛠️", "diag-section s-fix"
-        elif "Base" in title or "Enrichissement" in title: icon, css = "💾", "diag-section s-data"
-        html_res += f"<div class='{css}'><div class='section-header'>{icon} {title}</div><div class='section-body'>{body}</div></div>"
-    if web_info:
-        web_body = web_info.replace("**", "<b>").replace("\n", "<br>")
-        html_res += f"<div class='diag-section s-web'><div class='section-header'>🌐 SOLUTIONS WEB TEMPS RÉEL</div><div class='section-body'>{web_body}</div></div>"
-    return html_res
+    html_res = "".join(format_section(s) for s in sections)
+    return html_res + format_web_block(web_info)
 
 # --- LOGIQUE DE DIAGNOSTIC (Modèle Stable Llama 4 Scout) ---
-@app.post("/diagnostic")
-async def diagnostic(image: UploadFile = File(None), panne_description: str = Form("")):
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-    
+# DIAG_MODE : "parallel" lance la recherche web en même temps que la vision, "sequential" garde l'ancien enchaînement.
+DIAG_MODE = os.environ.get("DIAG_MODE", "parallel")
+GROQ_DEADLINE = float(os.environ.get("GROQ_DEADLINE", "30"))
+WEB_DEADLINE = float(os.environ.get("WEB_DEADLINE", "25"))
+DIAG_BUDGET = float(os.environ.get("DIAG_BUDGET", "32"))
+# Second passage Perplexity avec le matériel identifié, seulement s'il reste assez de budget
+WEB_REFINE = os.environ.get("WEB_REFINE", "0") == "1"
+WEB_REFINE_MIN = float(os.environ.get("WEB_REFINE_MIN", "8"))
+# Durée maximale d'un diagnostic : pire cas du mode choisi (le séquentiel enchaîne les deux délais), plus la photo
+FLIGHT_TTL = (GROQ_DEADLINE + WEB_DEADLINE if DIAG_MODE == "sequential" else DIAG_BUDGET) + 5
+# Référence connue : fiche locale renvoyée tout de suite, l'analyse IA suit (FAST_PATH=0 pour désactiver)
+FAST_PATH = os.environ.get("FAST_PATH", "1") == "1"
+ENRICH_TTL = float(os.environ.get("ENRICH_TTL", "300"))
+# Contrôle d'admission : diagnostics simultanés (0 = pas de limite), file d'attente, attente maximale (s) avant 503
+ADMISSION_MAX_INFLIGHT = int(os.environ.get("ADMISSION_MAX_INFLIGHT", "16"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_DEADLINE = float(os.environ.get("ADMISSION_DEADLINE", "10"))
+
+REF_PATTERN = re.compile(r"R[ée]f[ée]rence\s*:\s*([\w.\-]+)", re.IGNORECASE)
+
+def extract_reference(text: str):
+    """Retourne la référence scannée ("Référence : XXXX") si présente."""
+    m = REF_PATTERN.search(text or "")
+    return m.group(1) if m else None
+
+def build_web_query(panne_description: str, analysis: str = "") -> str:
+    query = f"Solution technique Somfy précise pour : {panne_description}."
+    ref = extract_reference(panne_description)
+    if ref: query += f" Référence produit : {ref}."
+    if analysis: query += f" Matériel : {analysis[:100]}"
+    return query
+
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+async def analyse_vision(messages: list) -> str:
+    client = app.state.groq
+    if client is None: raise RuntimeError("GROQ_API_KEY non configurée")
+    # UTILISATION DU MODÈLE DE PRODUCTION STABLE LLAMA 4 SCOUT
+    with metrics.stage("groq"):
+        response = await upstream.groq.call(lambda: client.chat.completions.create(
+            messages=messages,
+            model=VISION_MODEL,
+            temperature=0.1
+        ), client.api_key)
+    metrics.count_tokens("groq", response.usage)
+    if response.usage:
+        logger.info("Groq : %d tokens de prompt, %d tokens générés", response.usage.prompt_tokens, response.usage.completion_tokens)
+    return response.choices[0].message.content
+
+async def stream_vision(messages: list):
+    """Variante streamée : renvoie chaque section ## dès que la suivante commence."""
+    client = app.state.groq
+    if client is None: raise RuntimeError("GROQ_API_KEY non configurée")
+    # Seule l'ouverture du flux est relancée : une coupure en cours de génération remonte telle quelle
+    stream = await upstream.groq.call(lambda: client.chat.completions.create(
+        messages=messages,
+        model=VISION_MODEL,
+        temperature=0.1,
+        stream=True
+    ), client.api_key)
+    buf = ""
+    start = time.perf_counter()
+    async for chunk in stream:
+        # Groq transmet l'usage dans le dernier fragment (x_groq.usage)
+        metrics.count_tokens("groq", getattr(getattr(chunk, "x_groq", None), "usage", None))
+        if not chunk.choices: continue
+        buf += chunk.choices[0].delta.content or ""
+        parts = re.split(r'#{2,}', buf)
+        for section in parts[:-1]:
+            if section.strip(): yield section
+        buf = parts[-1]
+    metrics.record("groq_stream", time.perf_counter() - start)
+    if buf.strip(): yield buf
+
+def vision_error(e: Exception) -> str:
+    if isinstance(e, upstream.CircuitOpenError):
+        return f"## 🚫 Analyse vision suspendue\nLe modèle Llama 4 Scout est ignoré : {e}."
+    if isinstance(e, asyncio.TimeoutError):
+        return f"## ⏱️ Délai dépassé\nLe modèle Llama 4 Scout n'a pas répondu en {GROQ_DEADLINE:g} s."
+    return f"## ⚠️ Erreur ## Problème avec le modèle Llama 4 Scout : {str(e)}"
+
+async def run_sequential(messages: list, panne_description: str):
+    vision_ok = False
+    try:
+        analysis = await asyncio.wait_for(analyse_vision(messages), GROQ_DEADLINE)
+        vision_ok = True
+    except Exception as e:
+        analysis = vision_error(e)
+    try:
+        web_info = await asyncio.wait_for(search_perplexity(build_web_query(panne_description, analysis)), WEB_DEADLINE)
+    except asyncio.TimeoutError:
+        web_info = WEB_TIMEOUT
+    return analysis, web_info, vision_ok and web_info not in WEB_FAILURES
+
+async def run_parallel(messages: list, panne_description: str):
+    """Vision et recherche web en parallèle : la latence est bornée par l'appel le plus lent et par DIAG_BUDGET."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DIAG_BUDGET
+    vision = asyncio.create_task(asyncio.wait_for(analyse_vision(messages), GROQ_DEADLINE))
+    web = asyncio.create_task(asyncio.wait_for(search_perplexity(build_web_query(panne_description)), WEB_DEADLINE))
+    await asyncio.wait({vision, web}, timeout=DIAG_BUDGET)
+
+    # On rend ce qui est arrivé, le reste est abandonné (cancel() ne fait que demander l'arrêt : la tâche n'est pas finie)
+    vision_ok = False
+    if not vision.done():
+        vision.cancel()
+        analysis = f"## ⏱️ Délai dépassé\nAnalyse vision interrompue (budget de {DIAG_BUDGET:g} s atteint)."
+    elif vision.exception():
+        analysis = vision_error(vision.exception())
+    else:
+        analysis = vision.result()
+        vision_ok = True
+
+    if web.done() and web.exception() is None:
+        web_info = web.result()
+    else:
+        web.cancel()
+        web_info = WEB_TIMEOUT
+
+    complete = vision_ok and web_info not in WEB_FAILURES
+    remaining = deadline - loop.time()
+    if WEB_REFINE and vision_ok and remaining > WEB_REFINE_MIN:
+        try:
+            refined = await asyncio.wait_for(search_perplexity(build_web_query(panne_description, analysis)), min(WEB_DEADLINE, remaining))
+            if refined and refined not in WEB_FAILURES:
+                web_info = f"{web_info}\n\n**Affinage selon le matériel identifié :**\n{refined}" if web_info else refined
+        except asyncio.TimeoutError:
+            pass
+    return analysis, web_info, complete
+
+def product_context(panne_description: str) -> str:
+    """Fiches des produits pertinents (référence scannée + mots-clés), jamais la base entière."""
+    if retrieval is None: return "{}"
+    products = retrieval.top_k(panne_description, extract_reference(panne_description), RETRIEVAL_TOP_K)
+    return retrieval.format_context(products)
+
+# --- BASE DE CAS (pannes récurrentes) ---
+def record_case(key: str, panne_description: str, sections: list, html: str):
+    app.state.cases.add(key, panne_description, extract_reference(panne_description) or "", sections, html)
+
+def case_answer(panne_description: str, image_bytes: bytes):
+    """Cas validé quasi identique (même produit) : (html, id) rendu sans appel IA, sinon None.
+    Jamais pour une photo : elle montre une installation précise que le cas passé n'a pas vue."""
+    if image_bytes or not panne_description.strip(): return None
+    hits = app.state.cases.similar(panne_description, 1)
+    if not hits: return None
+    case_id, score, meta = hits[0]
+    if meta["feedback"] != "ok" or score < CASE_DIRECT_MIN: return None
+    if (extract_reference(panne_description) or "") != (meta["reference"] or ""): return None
+    case = app.state.cases.get(case_id)
+    app.state.cases.direct_answers += 1
+    date = time.strftime("%d/%m/%Y", time.localtime(case["created"]))
+    head = format_section(
+        f"✅ Cas déjà résolu et validé ({score:.0%} de similarité)\n"
+        f"Panne d'origine ({date}) : « {case['description']} »\n"
+        "Réponse issue de la base de cas, sans nouvel appel IA. Relancez avec plus de détails si la situation diffère."
+    )
+    return head + case["html"], case_id
+
+def case_context(panne_description: str) -> str:
+    """Cas proches déjà traités (hors cas rejetés), proposés au modèle comme pistes."""
+    blocks = []
+    for case_id, score, meta in app.state.cases.similar(panne_description, CASE_CONTEXT_K):
+        if score < CASE_CONTEXT_MIN: continue
+        case = app.state.cases.get(case_id)
+        fix = next((s["body"] for s in case["sections"] if "Correction" in s["title"]), "")
+        status = "validé par un technicien" if meta["feedback"] == "ok" else "non vérifié"
+        blocks.append(f"- Panne : {case['description'][:200]} ({status}, similarité {score:.0%})\n  Résolution : {fix[:400]}")
+    return "\n".join(blocks)
+
+async def fast_card(panne_description: str):
+    """Fiche produit locale (specs, raccordements, notices) si la référence scannée est au catalogue, sinon None."""
+    ref = extract_reference(panne_description)
+    if not (FAST_PATH and ref): return None
+    with metrics.stage("fast_card"):
+        product = get_product_by_ref(ref)
+        if not product: return None
+        card = await agent_somfy_specialist(ref, product)
+        html_card = format_html_output(card)
+        docs = "<br>".join(f"<a href='{escape(d['url'])}' target='_blank'>📄 {escape(d['title'])}</a>" for d in product.get("documents", []))
+        if docs: html_card += section_html("Notices officielles Somfy", docs)
+        return html_card
+
+def build_messages(panne_description: str, image_bytes: bytes = None, mime: str = "image/jpeg") -> list:
+    cases = case_context(panne_description)
+    cases_block = f"\n    CAS SIMILAIRES DÉJÀ TRAITÉS (pistes à confirmer, jamais à recopier) :\n    {cases}\n" if cases else ""
     prompt_systeme = f"""Tu es l'Expert Technique Somfy Ultime.
-    Tu as accès à cette BASE DE DONNÉES PRIVÉE : {BASE_TECHNIQUE}.
-    
+    Tu as accès à cette BASE DE DONNÉES PRIVÉE (produits pertinents) :
+    {product_context(panne_description)}
+    {cases_block}
     TA MISSION :
     1. Si une image est fournie : ANALYSE-LA visuellement avec une précision extrême (borniers, câblage, état des LEDs, références).
     2. Identifie le produit exact et compare-le à la BASE DE DONNÉES fournie.
@@ -95,34 +415,340 @@ async def diagnostic(image: UploadFile = File(None), panne_description: str = Fo
     messages = [{"role": "system", "content": prompt_systeme}]
     user_content = [{"type": "text", "text": f"PROBLÈME DÉCRIT : {panne_description}"}]
     
-    if image and image.filename:
-        img_b64 = base64.b64encode(await image.read()).decode('utf-8')
+    if image_bytes:
+        with metrics.stage("encode"):
+            img_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        metrics.count_bytes("encode", len(img_b64))
         user_content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}
+            "image_url": {"url": f"data:{mime};base64,{img_b64}"}
         })
     
     messages.append({"role": "user", "content": user_content})
+    metrics.count_bytes("prompt", len(prompt_systeme.encode()))
+    logger.info("Prompt système : ~%d tokens", len(prompt_systeme) // 4)
+    return messages
 
-    try:
-        # UTILISATION DU MODÈLE DE PRODUCTION STABLE LLAMA 4 SCOUT
-        response = client.chat.completions.create(
-            messages=messages,
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            temperature=0.1
+async def read_image(image: UploadFile):
+    if image and image.filename:
+        with metrics.stage("upload"):
+            data = await images.read_upload(image, int(MAX_UPLOAD_MB * 1024 * 1024))
+        metrics.count_bytes("upload", len(data))
+        return data
+    return None
+
+async def prepare_messages(panne_description: str, image_bytes: bytes):
+    """Construit les messages ; la photo est préparée dans le pool d'images. Retourne (messages, en-têtes)."""
+    if not image_bytes:
+        return build_messages(panne_description), {}
+    loop = asyncio.get_running_loop()
+    with metrics.stage("image"):
+        data, mime, st = await loop.run_in_executor(
+            app.state.image_pool, images.prepare_image, image_bytes, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY
         )
-        analysis = response.choices[0].message.content
+    metrics.count_bytes("image", len(data))
+    headers = {"X-Image-Prep": f"{st['format']} {st['bytes_in']}->{st['bytes_out']} B; {st['ms']} ms"}
+    return build_messages(panne_description, data, mime), headers
+
+async def compute_diagnostic(panne_description: str, image_bytes: bytes):
+    """Pipeline complet (cache, photo, vision + web, rendu) ; retourne (html, en-têtes, complet)."""
+    key = cache_key(image_bytes, panne_description)
+    with metrics.stage("cache"):
+        cached = app.state.cache.get(key)
+    if cached is not None:
+        return cached, {"X-Cache": "HIT", "X-Case-Id": key}, True
+    direct = case_answer(panne_description, image_bytes)
+    if direct:
+        return direct[0], {"X-Cache": "MISS", "X-Case-Id": direct[1], "X-Case-Match": "1"}, True
+
+    async def miss():
+        messages, headers = await prepare_messages(panne_description, image_bytes)
+        if DIAG_MODE == "sequential":
+            analysis, web_info, complete = await run_sequential(messages, panne_description)
+        else:
+            analysis, web_info, complete = await run_parallel(messages, panne_description)
+        with metrics.stage("render"):
+            html = format_html_output(analysis, web_info)
+        # Un rapport partiel (erreur, délai dépassé) n'est jamais mis en cache ni gardé comme cas
+        if not complete: return html, {"X-Cache": "MISS", **headers}, False
+        app.state.cache.set(key, html)
+        record_case(key, panne_description, parse_sections(analysis, web_info), html)
+        return html, {"X-Cache": "MISS", "X-Case-Id": key, **headers}, True
+
+    # Même photo + même description déjà en cours (scan répété, double tap) : on attend le calcul existant
+    (html, headers, complete), shared = await app.state.flights.do(key, miss, FLIGHT_TTL)
+    return html, ({**headers, "X-Coalesced": "1"} if shared else headers), complete
+
+def priorite(image: UploadFile, panne_description: str, card_only: bool = False) -> int:
+    """RAPIDE seulement si la réponse est servie localement : rapport texte en cache, ou fiche d'une référence connue
+    quand l'analyse IA part en tâche de fond (`card_only`, POST /diagnostic). Décidé avant de lire la photo."""
+    if card_only:
+        ref = extract_reference(panne_description)
+        if FAST_PATH and ref and get_product_by_ref(ref): return RAPIDE
+    if not (image and image.filename) and app.state.cache.contains(cache_key(None, panne_description)): return RAPIDE
+    return COMPLET
+
+async def admitted(priority: int, make_coro):
+    async with app.state.admission.slot(priority):
+        return await make_coro()
+
+async def enrichir(panne_description: str, image_bytes: bytes):
+    """Analyse IA d'une voie rapide : passe après les requêtes qui attendent une réponse et, refusée pendant une
+    rafale, réessaie après le délai conseillé tant qu'elle reste récupérable."""
+    deadline = time.monotonic() + ENRICH_TTL / 2
+    while True:
+        try:
+            return await admitted(FOND, lambda: compute_diagnostic(panne_description, image_bytes))
+        except Surcharge as e:
+            if time.monotonic() + e.retry_after > deadline: raise
+            await asyncio.sleep(e.retry_after)
+
+async def release_after(chunks, release):
+    try:
+        async for chunk in chunks: yield chunk
+    finally:
+        release()
+
+@app.post("/diagnostic")
+async def diagnostic(image: UploadFile = File(None), panne_description: str = Form("")):
+    async with app.state.admission.slot(priorite(image, panne_description, card_only=True)):
+        return await diagnostic_admis(image, panne_description)
+
+async def diagnostic_admis(image: UploadFile, panne_description: str):
+    image_bytes = await read_image(image)
+    card = await fast_card(panne_description)
+    if card is None:
+        html, headers, _ = await compute_diagnostic(panne_description, image_bytes)
+        return HTMLResponse(content=html, headers=headers)
+
+    key = cache_key(image_bytes, panne_description)
+    cached = app.state.cache.get(key)
+    if cached is not None:
+        return HTMLResponse(content=card + cached, headers={"X-Cache": "HIT", "X-Fast-Path": "1"})
+    # La fiche part tout de suite ; l'analyse IA + web tourne en tâche de fond, récupérée par GET /diagnostic/enrichissement/{key}
+    if key not in app.state.enrichments:
+        app.state.enrichments[key] = asyncio.create_task(enrichir(panne_description, image_bytes))
+        asyncio.get_running_loop().call_later(ENRICH_TTL, app.state.enrichments.pop, key, None)
+    return HTMLResponse(content=card, headers={
+        "X-Cache": "MISS", "X-Fast-Path": "1", "X-Enrichment": f"/diagnostic/enrichissement/{key}"
+    })
+
+@app.get("/diagnostic/enrichissement/{key}")
+async def diagnostic_enrichissement(key: str):
+    """Analyse IA + web lancée par la voie rapide : attend la fin du calcul (borné par le budget diagnostic)."""
+    task = app.state.enrichments.get(key)
+    if task is None:
+        cached = app.state.cache.get(key)
+        if cached is None: return JSONResponse({"detail": "Enrichissement inconnu ou expiré"}, status_code=404)
+        return HTMLResponse(content=cached, headers={"X-Cache": "HIT"})
+    try:
+        html, headers, _ = await asyncio.wait_for(asyncio.shield(task), FLIGHT_TTL)
+    except asyncio.TimeoutError:
+        return JSONResponse({"detail": "Enrichissement toujours en cours"}, status_code=504)
+    except Surcharge:
+        raise  # 503 + Retry-After : l'enrichissement n'a pas trouvé de place pendant la rafale
     except Exception as e:
-        analysis = f"## ⚠️ Erreur ## Problème avec le modèle Llama 4 Scout : {str(e)}"
+        return HTMLResponse(content=format_html_output(vision_error(e)), status_code=502)
+    return HTMLResponse(content=html, headers=headers)
 
-    web_query = f"Solution technique Somfy précise pour : {panne_description}. Matériel : {analysis[:100]}"
-    web_info = await search_perplexity(web_query)
-    
-    return HTMLResponse(content=format_html_output(analysis, web_info))
+async def stream_diagnostic(messages: list, panne_description: str, key: str, flight: asyncio.Future, card: str = None):
+    """Produit les blocs HTML dans l'ordre d'arrivée : fiche locale éventuelle, sections vision au fil de l'eau,
+    bloc web dès que Perplexity répond."""
+    if card: yield card
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DIAG_BUDGET
+    queue = asyncio.Queue()
+    failed = False
+    sections, web_info = [], ""
+
+    async def vision_producer():
+        try:
+            async with asyncio.timeout(GROQ_DEADLINE):
+                async for section in stream_vision(messages):
+                    sections.append(section)
+                    await queue.put(format_section(section))
+        except Exception as e:
+            nonlocal failed
+            failed = True
+            await queue.put(format_html_output(vision_error(e)))
+        finally:
+            await queue.put(None)
+
+    async def web_producer():
+        nonlocal failed, web_info
+        try:
+            web_info = await asyncio.wait_for(search_perplexity(build_web_query(panne_description)), WEB_DEADLINE)
+        except asyncio.TimeoutError:
+            web_info = WEB_TIMEOUT
+        if web_info in WEB_FAILURES: failed = True
+        await queue.put(format_web_block(web_info))
+        await queue.put(None)
+
+    tasks = [asyncio.create_task(vision_producer()), asyncio.create_task(web_producer())]
+    pending = len(tasks)
+    blocks = []
+    try:
+        while pending:
+            try:
+                block = await asyncio.wait_for(queue.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                failed = True
+                yield format_html_output(f"## ⏱️ Délai dépassé\nDiagnostic interrompu (budget de {DIAG_BUDGET:g} s atteint).")
+                break
+            if block is None: pending -= 1
+            elif block:
+                blocks.append(block)
+                yield block
+        if not failed:
+            app.state.cache.set(key, "".join(blocks))
+            record_case(key, panne_description, parse_sections("##".join(sections), web_info), "".join(blocks))
+            # Identifiant du cas envoyé en dernier bloc, une fois le cas enregistré (un rapport partiel n'en a pas)
+            yield f"<div data-case-id='{key}' hidden></div>"
+        # Les requêtes identiques arrivées entre-temps reçoivent le rapport tel qu'il a été diffusé
+        if not flight.done(): flight.set_result(("".join(blocks), {}, not failed))
+    finally:
+        for t in tasks: t.cancel()
+        # Client parti en cours de route : rapport tronqué, les suiveurs relancent leur propre calcul
+        if not flight.done(): flight.set_exception(ConnectionError("diffusion interrompue"))
+
+@app.post("/diagnostic/stream")
+async def diagnostic_stream(image: UploadFile = File(None), panne_description: str = Form("")):
+    release = await app.state.admission.acquire(priorite(image, panne_description))
+    try:
+        response = await diagnostic_stream_admis(image, panne_description, release)
+    except BaseException:
+        release()
+        raise
+    # Réponse immédiate : place rendue ; flux : rendue en fin d'envoi (ou à la déconnexion, via la tâche de fond)
+    if not isinstance(response, StreamingResponse): release()
+    return response
+
+async def diagnostic_stream_admis(image: UploadFile, panne_description: str, release):
+    image_bytes = await read_image(image)
+    card = await fast_card(panne_description)
+    key = cache_key(image_bytes, panne_description)
+    cached = app.state.cache.get(key)
+    if cached is not None:
+        return HTMLResponse(content=(card or "") + cached, headers={"X-Cache": "HIT", "X-Case-Id": key})
+    direct = case_answer(panne_description, image_bytes)
+    if direct:
+        return HTMLResponse(content=(card or "") + direct[0], headers={"X-Case-Id": direct[1], "X-Case-Match": "1"})
+    pending = app.state.flights.join(key)
+    if pending is not None:
+        try:
+            html, _, _ = await pending
+            return HTMLResponse(content=(card or "") + html, headers={"X-Cache": "MISS", "X-Coalesced": "1"})
+        except Exception:
+            pass  # calcul partagé en échec ou expiré : on repart sur un calcul propre
+    flight = app.state.flights.begin(key, FLIGHT_TTL)
+    try:
+        messages, headers = await prepare_messages(panne_description, image_bytes)
+    except BaseException as e:
+        flight.set_exception(e if isinstance(e, Exception) else asyncio.CancelledError())
+        raise
+    del image_bytes
+    return StreamingResponse(
+        release_after(stream_diagnostic(messages, panne_description, key, flight, card), release),
+        media_type="text/html; charset=utf-8", background=BackgroundTask(release),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                 **({"X-Fast-Path": "1"} if card else {}), **headers}
+    )
+
+@app.post("/cas/{case_id}/feedback")
+async def case_feedback(case_id: str, verdict: str = Form(...), note: str = Form("")):
+    """Retour du technicien sur un diagnostic : « ok » le valide pour les réponses directes, « ko » l'écarte."""
+    if verdict not in ("ok", "ko"): return JSONResponse({"detail": "verdict attendu : ok ou ko"}, status_code=400)
+    if not app.state.cases.feedback(case_id, verdict, note.strip()):
+        return JSONResponse({"detail": "Cas inconnu"}, status_code=404)
+    return {"case_id": case_id, "feedback": verdict}
+
+# --- ORCHESTRATION DES AGENTS ---
+@app.post("/rapport")
+async def rapport(reference: str = Form(""), panne_description: str = Form("")):
+    """Rapport multi-agents : spécialiste local, diagnostiqueur et documenteur exécutés en parallèle."""
+    reference = reference.strip() or extract_reference(panne_description) or ""
+    report = await orchestrer(reference, panne_description)
+    with metrics.stage("render"):
+        html = format_html_output(report)
+    return HTMLResponse(content=html)
+
+# --- DIAGNOSTICS EN LOT ---
+def job_providers(ticket: dict) -> list:
+    """Fournisseurs que le ticket appellera réellement : aucun si le rapport est déjà en cache."""
+    if app.state.cache.contains(cache_key(ticket_image(ticket), ticket_description(ticket))): return []
+    return [name for name, configured in (("groq", app.state.groq is not None),
+                                          ("perplexity", bool(os.environ.get("PERPLEXITY_API_KEY")))) if configured]
+
+async def run_job(ticket: dict) -> str:
+    html, _, complete = await compute_diagnostic(ticket_description(ticket), ticket_image(ticket))
+    # Fournisseur en échec ou délai dépassé : rapport gardé, mais le ticket passe en erreur pour être relancé
+    if not complete: raise IncompleteReport(html)
+    return html
+
+@app.post("/jobs")
+async def create_jobs(fichier: UploadFile = File(...)):
+    """Crée un lot à partir d'un export JSONL / CSV (reference, panne_description, image_base64 optionnelle)."""
+    try:
+        tickets = parse_batch(await fichier.read(), fichier.filename or "")
+    except (ValueError, KeyError) as e:
+        return JSONResponse({"detail": f"Fichier illisible : {e}"}, status_code=400)
+    if not tickets:
+        return JSONResponse({"detail": "Aucun ticket dans le fichier."}, status_code=400)
+    batch_id = app.state.jobs.create_batch(tickets)
+    app.state.scheduler.notify()
+    return {"batch_id": batch_id, "total": len(tickets)}
+
+@app.get("/jobs/{batch_id}")
+async def job_progress(batch_id: str):
+    progress = app.state.jobs.progress(batch_id)
+    if progress is None: return JSONResponse({"detail": "Lot inconnu"}, status_code=404)
+    return progress
+
+@app.get("/jobs/{batch_id}/results")
+async def job_results(batch_id: str, offset: int = 0, limit: int = 100):
+    """Résultats partiels : tickets déjà terminés, même si le lot est encore en cours."""
+    if app.state.jobs.progress(batch_id) is None: return JSONResponse({"detail": "Lot inconnu"}, status_code=404)
+    return app.state.jobs.results(batch_id, offset, min(limit, 1000))
+
+@app.get("/jobs/{batch_id}/download")
+async def job_download(batch_id: str):
+    """Rapports terminés en JSONL, lus par pages pour ne jamais charger tout le lot en mémoire."""
+    if app.state.jobs.progress(batch_id) is None: return JSONResponse({"detail": "Lot inconnu"}, status_code=404)
+
+    async def lines():
+        offset = 0
+        while True:
+            page = app.state.jobs.results(batch_id, offset, 200)
+            if not page: break
+            for row in page:
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+            offset += len(page)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f"attachment; filename=diagnostics_{batch_id}.jsonl"})
+
+# Lus à l'export : /metrics n'est servi qu'une fois le lifespan démarré
+metrics.Gauge("somfy_admission_in_flight", "Diagnostics admis en cours", lambda: app.state.admission.inflight)
+metrics.Gauge("somfy_admission_queue_depth", "Diagnostics en attente d'admission", lambda: app.state.admission.queued())
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    return {"cache": app.state.cache.stats(), "images": images.STATS, "jobs_pending": app.state.jobs.pending_count(),
+            "singleflight": app.state.flights.stats(), "admission": app.state.admission.stats(),
+            "cases": app.state.cases.stats(), "precalcul": precalcul.stats(),
+            "static": {path: asset.stats() for path, asset in app.state.static.items()},
+            "upstream": {"groq": upstream.groq.snapshot(), "perplexity": upstream.perplexity.snapshot()}}
 
 # --- INTERFACE FRONT-END ---
 @app.get("/", response_class=HTMLResponse)
-def home():
+async def home(request: Request):
+    return app.state.static["/"].response(request)
+
+def render_shell() -> str:
     return f"""<!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -156,6 +782,11 @@ def home():
         
         #reader {{ width: 100%; border-radius: 12px; overflow: hidden; display: none; margin-top: 10px; }}
         #preview {{ width: 100%; border-radius: 12px; display: none; margin: 15px 0; border: 2px solid #38bdf8; max-height: 300px; object-fit: cover; }}
+        .hist {{ width: 100%; text-align: left; background: #0f172a; color: #94a3b8; border: 1px solid #334155; border-radius: 10px; padding: 10px 12px; margin-top: 8px; cursor: pointer; font-size: 0.85rem; }}
+        .queued {{ color: #fbbf24; font-weight: bold; margin-top: 15px; }}
+        #history {{ margin-top: 20px; }}
+        #fb {{ display: none; align-items: center; gap: 10px; margin-top: 15px; color: #94a3b8; font-size: 0.9rem; }}
+        #fb button {{ background: #334155; color: white; border: none; border-radius: 10px; padding: 8px 14px; cursor: pointer; }}
         #loading {{ display: none; text-align: center; color: #38bdf8; font-weight: bold; padding: 20px; }}
         @keyframes pulse {{ 0% {{box-shadow: 0 0 0 0 rgba(239, 68, 68, 0.7);}} 70% {{box-shadow: 0 0 0 10px rgba(239, 68, 68, 0);}} 100% {{box-shadow: 0 0 0 0 rgba(239, 68, 68, 0);}} }}
     </style>
@@ -177,19 +808,105 @@ def home():
     <button id="rs" class="btn" style="background:#ef4444; color:white; display:none" onclick="reset()">🔄 NOUVEAU DIAGNOSTIC</button>
     <div id="loading">📡 Analyse Groq Vision & Recherche Web...</div>
     <div id="result"></div>
+    <div id="fb"><span>Ce diagnostic était-il juste ?</span>
+        <button onclick="feedback('ok')">👍 Oui</button><button onclick="feedback('ko')">👎 Non</button></div>
+    <div id="history"></div>
 </div>
 <script>
     if ('serviceWorker' in navigator) {{ navigator.serviceWorker.register('/sw.js'); }}
-    window.onload = () => {{
-        const saved = localStorage.getItem('lastDiag');
-        if(saved) {{
-            document.getElementById('result').innerHTML = saved;
-            document.getElementById('rs').style.display = 'flex';
-            document.getElementById('sh').style.display = 'flex';
+    // --- Historique et file hors ligne (IndexedDB) ---
+    const MAX_HISTORY = 20;
+    const DB = new Promise((ok, ko) => {{
+        const r = indexedDB.open('somfy-diag', 1);
+        r.onupgradeneeded = () => {{
+            r.result.createObjectStore('diagnostics', {{ keyPath: 'id', autoIncrement: true }});
+            r.result.createObjectStore('outbox', {{ keyPath: 'id', autoIncrement: true }});
+        }};
+        r.onsuccess = () => ok(r.result);
+        r.onerror = () => ko(r.error);
+    }});
+    function idb(store, mode, fn) {{
+        return DB.then(db => new Promise((ok, ko) => {{
+            const t = db.transaction(store, mode);
+            const req = fn(t.objectStore(store));
+            t.oncomplete = () => ok(req.result);
+            t.onerror = () => ko(t.error);
+        }}));
+    }}
+    const all = (store) => idb(store, 'readonly', s => s.getAll());
+    const put = (store, v) => idb(store, 'readwrite', s => s.add(v));
+    const del = (store, id) => idb(store, 'readwrite', s => s.delete(id));
+    async function saveDiag(desc, html, caseId) {{
+        await put('diagnostics', {{ date: Date.now(), desc, html, caseId }});
+        const items = await all('diagnostics');
+        for (const d of items.slice(0, Math.max(items.length - MAX_HISTORY, 0))) await del('diagnostics', d.id);
+        showHistory();
+    }}
+    // Identifiant du cas affiché (en-tête X-Case-Id ou bloc data-case-id du flux) pour le retour du technicien
+    let currentCase = null;
+    function show(html, caseId) {{
+        currentCase = caseId || null;
+        document.getElementById('fb').style.display = currentCase ? 'flex' : 'none';
+        document.getElementById('result').innerHTML = html;
+        document.getElementById('rs').style.display = 'flex';
+        document.getElementById('sh').style.display = 'flex';
+    }}
+    async function showHistory() {{
+        const box = document.getElementById('history');
+        const items = (await all('diagnostics')).reverse();
+        const queued = await all('outbox');
+        box.innerHTML = "";
+        if (queued.length) {{
+            const q = document.createElement('div');
+            q.className = 'queued';
+            q.textContent = `📥 ${{queued.length}} diagnostic(s) en attente de réseau`;
+            box.appendChild(q);
+        }}
+        for (const d of items) {{
+            const b = document.createElement('button');
+            b.className = 'hist';
+            b.textContent = new Date(d.date).toLocaleString('fr-FR') + " — " + (d.desc || "Photo").slice(0, 60);
+            b.onclick = () => {{ show(d.html, d.caseId); window.scrollTo(0, 0); }};
+            box.appendChild(b);
         }}
+    }}
+    window.onload = async () => {{
+        // Reprise de l'ancien rapport unique (localStorage) dans l'historique
+        const legacy = localStorage.getItem('lastDiag');
+        if (legacy) {{ await put('diagnostics', {{ date: Date.now(), desc: "", html: legacy }}); localStorage.removeItem('lastDiag'); }}
+        const items = await all('diagnostics');
+        if (items.length) show(items[items.length - 1].html, items[items.length - 1].caseId);
+        showHistory();
+        replay();
     }};
+    window.addEventListener('online', replay);
+    let replaying = false;
+    async function replay() {{
+        if (replaying || !navigator.onLine) return;
+        replaying = true;
+        try {{
+            for (const job of await all('outbox')) {{
+                const fd = new FormData();
+                if (job.image) fd.append('image', job.image, job.name || 'photo.jpg');
+                fd.append('panne_description', job.desc);
+                let r;
+                try {{ r = await fetch('/diagnostic', {{ method: 'POST', body: fd }}); }} catch (e) {{ break; }}
+                if (r.status === 503) {{ setTimeout(replay, retryDelay(r) * 1000); break; }}
+                if (!r.ok && r.status >= 500) break;
+                await saveDiag(job.desc, await r.text(), r.headers.get('X-Case-Id'));
+                await del('outbox', job.id);
+            }}
+        }} finally {{ replaying = false; showHistory(); }}
+    }}
+    async function enqueue(desc) {{
+        await put('outbox', {{ date: Date.now(), desc, image: file, name: file ? file.name : null }});
+        show(`<div class='diag-section'><div class='section-header'>📥 Hors réseau</div><div class='section-body'>Diagnostic mis en file : il sera lancé automatiquement au retour du réseau et rangé dans l'historique.</div></div>`);
+        document.getElementById('go').style.display = 'flex';
+        showHistory();
+    }}
     let scanner;
     function startScan() {{
+        if (typeof Html5Qrcode === 'undefined') return alert("Scanner indisponible hors réseau (premier chargement)");
         document.getElementById('reader').style.display = 'block';
         document.getElementById('btnScan').style.display = 'none';
         scanner = new Html5Qrcode("reader");
@@ -223,31 +940,77 @@ def home():
         r.onload = (e) => {{ const p = document.getElementById('preview'); p.src = e.target.result; p.style.display = 'block'; }};
         r.readAsDataURL(file);
     }}
-    async function run() {{
+    const MAX_RETRIES = 3;
+    function retryDelay(r) {{ return parseInt(r.headers.get('Retry-After'), 10) || 5; }}
+    async function run(attempt = 0) {{
         const res = document.getElementById('result');
         const load = document.getElementById('loading');
         const go = document.getElementById('go');
+        const desc = document.getElementById('desc').value;
+        if (!navigator.onLine) return enqueue(desc);
         go.style.display = 'none'; load.style.display = 'block'; res.innerHTML = "";
+        document.getElementById('fb').style.display = 'none';
         const fd = new FormData();
         if (file) fd.append('image', file);
-        fd.append('panne_description', document.getElementById('desc').value);
+        fd.append('panne_description', desc);
         try {{
-            const r = await fetch('/diagnostic', {{ method: 'POST', body: fd }});
-            const html = await r.text();
-            res.innerHTML = html;
-            localStorage.setItem('lastDiag', html);
-            document.getElementById('sh').style.display = 'flex';
-            document.getElementById('rs').style.display = 'flex';
-        }} catch (e) {{ alert("Erreur serveur"); go.style.display = 'flex'; }} 
+            const r = await fetch('/diagnostic/stream', {{ method: 'POST', body: fd }});
+            if (r.status === 503) {{
+                // Serveur saturé : nouvel essai automatique après le délai indiqué, quelques fois au plus
+                const wait = retryDelay(r);
+                const retry = attempt < MAX_RETRIES;
+                res.innerHTML = `<div class='diag-section'><div class='section-header'>⏳ Serveur saturé</div><div class='section-body'>${{retry ? `Beaucoup de diagnostics en cours : nouvel essai automatique dans ${{wait}} s…` : `Toujours saturé : relancez dans ${{wait}} s.`}}</div></div>`;
+                if (retry) setTimeout(() => run(attempt + 1), wait * 1000);
+                else go.style.display = 'flex';
+                return;
+            }}
+            let html = "";
+            if (r.body && r.body.getReader) {{
+                // Les sections arrivent une à une : on les affiche dès réception
+                const reader = r.body.getReader();
+                const dec = new TextDecoder();
+                while (true) {{
+                    const {{ done, value }} = await reader.read();
+                    if (done) break;
+                    html += dec.decode(value, {{ stream: true }});
+                    res.innerHTML = html;
+                }}
+            }} else {{
+                html = await r.text();
+                res.innerHTML = html;
+            }}
+            // Flux : l'identifiant du cas arrive en dernier bloc, seulement si le rapport complet a été enregistré
+            const marker = res.querySelector('[data-case-id]');
+            show(html, r.headers.get('X-Case-Id') || (marker && marker.dataset.caseId));
+            await saveDiag(desc, html, currentCase);
+        }} catch (e) {{
+            // Réseau perdu pendant l'envoi (TypeError de fetch) : la demande part en file d'attente
+            if (e instanceof TypeError) await enqueue(desc);
+            else {{ alert("Erreur serveur"); go.style.display = 'flex'; }}
+        }}
         finally {{ load.style.display = 'none'; }}
     }}
+    async function feedback(verdict) {{
+        if (!currentCase) return;
+        const fd = new FormData();
+        fd.append('verdict', verdict);
+        try {{ await fetch('/cas/' + currentCase + '/feedback', {{ method: 'POST', body: fd }}); }} catch (e) {{}}
+        document.getElementById('fb').style.display = 'none';
+    }}
     function share() {{
         const t = document.getElementById('result').innerText;
         if (navigator.share) {{ navigator.share({{ title: 'Rapport Somfy', text: t }}); }}
         else {{ navigator.clipboard.writeText(t); alert("Copié !"); }}
     }}
     function reset() {{
-        localStorage.removeItem('lastDiag'); location.reload();
+        // L'historique est conservé : on vide seulement l'écran pour un nouveau diagnostic
+        file = null;
+        document.getElementById('in').value = "";
+        document.getElementById('desc').value = "";
+        document.getElementById('preview').style.display = 'none';
+        document.getElementById('result').innerHTML = "";
+        ['sh', 'rs', 'fb'].forEach(id => document.getElementById(id).style.display = 'none');
+        document.getElementById('go').style.display = 'flex';
     }}
 </script>
 </body>
@@ -0,0 +1,82 @@
+"""Latence de POST /diagnostic pour une référence scannée : voie rapide (fiche locale) contre appel vision complet.
+
+Le modèle est simulé (latence fixe, sans réseau) pour isoler le coût du pipeline.
+Usage : python -m benchmarks.bench_fast_path [--requests 50] [--groq-latency 1.5] [--ref 1810392]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("GROQ_API_KEY", "bench")
+WORKDIR = tempfile.mkdtemp()
+for name in ("JOBS_DB", "CASES_DB", "PRECALCUL_DB"):
+    os.environ.setdefault(name, os.path.join(WORKDIR, name.split("_")[0].lower() + ".db"))
+os.environ.setdefault("PRECALCUL_RPM", "0")
+
+import httpx
+
+import app as appmod
+
+
+class FakeCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        content = "## Identification\nProduit identifié\n## Analyse\nCause probable\n## Correction\nProcédure"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0))
+
+
+def summary(label: str, timings: list):
+    q = statistics.quantiles(timings, n=100)
+    print(f"{label:<34}{q[49]:>10.1f}{q[94]:>10.1f}{q[98]:>10.1f}")
+
+
+async def run(args):
+    async with appmod.lifespan(appmod.app):
+        appmod.app.state.groq = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(args.groq_latency)),
+                                                api_key="bench", close=lambda: asyncio.sleep(0))
+        transport = httpx.ASGITransport(app=appmod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            fast, enriched, full = [], [], []
+            for i in range(args.requests):
+                # Descriptions toutes différentes : aucun passage par le cache
+                data = {"panne_description": f"Référence : {args.ref}\nMoteur muet (essai {i})"}
+
+                appmod.FAST_PATH = True
+                t = time.perf_counter()
+                r = await client.post("/diagnostic", data=data)
+                fast.append((time.perf_counter() - t) * 1000)
+                if "x-enrichment" in r.headers:
+                    await client.get(r.headers["x-enrichment"])
+                enriched.append((time.perf_counter() - t) * 1000)
+
+                appmod.FAST_PATH = False
+                data["panne_description"] += " sans voie rapide"
+                t = time.perf_counter()
+                await client.post("/diagnostic", data=data)
+                full.append((time.perf_counter() - t) * 1000)
+
+    print(f"{args.requests} requêtes, modèle simulé à {args.groq_latency:g} s")
+    print(f"{'chemin':<34}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    summary("voie rapide : fiche produit", fast)
+    summary("voie rapide : fiche + analyse IA", enriched)
+    summary("appel vision complet", full)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--groq-latency", type=float, default=1.5)
+    parser.add_argument("--ref", default="1810392")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
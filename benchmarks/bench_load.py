@@ -0,0 +1,231 @@
+"""Charge et latence de POST /diagnostic contre des fournisseurs simulés (benchmarks.fake_providers).
+
+L'application tourne sous uvicorn dans un processus séparé, cache désactivé : chaque requête traverse tout le
+pipeline. Pour chaque niveau de concurrence et chaque type de charge (texte, photos de 3 et 10 Mo, référence
+scannée), on mesure débit, latences p50/p95/p99, erreurs, retard de la boucle d'événements et RSS maximale.
+
+Usage : python -m benchmarks.bench_load [--levels 1,8,32] [--requests 20] [--groq-latency 0.8]
+        python -m benchmarks.bench_load --compare benchmarks/results/load-<commit>-<date>.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SCENARIOS = ["texte", "photo_3mo", "photo_10mo", "reference"]
+DESCRIPTIONS = [
+    "Le volet roulant du bureau 204 ne répond plus à la commande murale",
+    "Store extérieur bloqué en position basse après un orage, LED du récepteur éteinte",
+    "Moteur qui tourne quelques secondes puis s'arrête, claquement au démarrage",
+]
+
+
+def synthetic_photo(target_bytes: int) -> bytes:
+    """JPEG de bruit aléatoire (peu compressible) d'environ target_bytes, à la manière d'une photo de smartphone."""
+    side = int((target_bytes / 0.9) ** 0.5)
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def payload(scenario: str, i: int, photos: dict):
+    """Champs du formulaire ; la description varie à chaque requête pour ne jamais être coalescée."""
+    desc = f"{DESCRIPTIONS[i % len(DESCRIPTIONS)]} (essai {i})"
+    if scenario == "reference":
+        return {"panne_description": f"Référence : 1810392\n{desc}"}, None
+    if scenario.startswith("photo"):
+        return {"panne_description": desc}, {"image": ("photo.jpg", photos[scenario], "image/jpeg")}
+    return {"panne_description": desc}, None
+
+
+def parse_metrics(text: str) -> dict:
+    """Séries Prometheus utiles ici : {nom{labels}: valeur}."""
+    values = {}
+    for line in text.splitlines():
+        m = re.match(r"^(somfy_event_loop_lag_seconds_\w+(?:\{[^}]*\})?|somfy_process_peak_rss_bytes) (\S+)$", line)
+        if m: values[m.group(1)] = float(m.group(2))
+    return values
+
+
+def loop_lag(before: dict, after: dict) -> dict:
+    """Retard moyen et p99 (borne du seau) de la boucle d'événements sur l'intervalle mesuré."""
+    count = after.get("somfy_event_loop_lag_seconds_count", 0) - before.get("somfy_event_loop_lag_seconds_count", 0)
+    total = after.get("somfy_event_loop_lag_seconds_sum", 0) - before.get("somfy_event_loop_lag_seconds_sum", 0)
+    buckets = []
+    for key, value in after.items():
+        m = re.search(r'le="([^"]+)"', key)
+        if m: buckets.append((float(m.group(1)), value - before.get(key, 0)))  # float("+Inf") == inf
+    buckets.sort()
+    p99 = next((le for le, n in buckets if count and n >= 0.99 * count), None)
+    return {"mean_ms": round(1000 * total / count, 2) if count else None,
+            "p99_ms": None if p99 is None or p99 == float("inf") else round(1000 * p99, 1)}
+
+
+def quantiles(timings: list) -> dict:
+    if len(timings) < 2: return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    q = statistics.quantiles(timings, n=100)
+    return {"p50_ms": round(q[49], 1), "p95_ms": round(q[94], 1), "p99_ms": round(q[98], 1)}
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, scenario: str, concurrency: int, requests: int,
+                    photos: dict) -> dict:
+    timings, statuses = [], {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            data, files = payload(scenario, i, photos)
+            start = time.perf_counter()
+            try:
+                r = await client.post(endpoint, data=data, files=files)
+                await r.aread()
+                status = str(r.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    before = parse_metrics((await client.get("/metrics")).text)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    after = parse_metrics((await client.get("/metrics")).text)
+    return {
+        "scenario": scenario, "concurrency": concurrency, "requests": requests,
+        "throughput_rps": round(requests / wall, 2), **quantiles(timings),
+        "errors": requests - statuses.get("200", 0), "statuses": statuses,
+        "loop_lag": loop_lag(before, after),
+        "peak_rss_mb": round(after.get("somfy_process_peak_rss_bytes", 0) / 2 ** 20, 1),
+    }
+
+
+def start_process(args: list, log_path: str, env: dict = None) -> subprocess.Popen:
+    """Processus Python en arrière-plan ; sa sortie va dans un fichier (un tube plein le bloquerait)."""
+    log = open(log_path, "wb")
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **(env or {})}, stdout=log, stderr=log)
+
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                with open(proc.stdout.name, encoding="utf-8", errors="replace") as f:
+                    raise RuntimeError(f"{url} : processus arrêté\n{f.read()}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} ne répond pas après {timeout:g} s")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+
+
+def print_table(runs: list, reference: dict = None):
+    print(f"{'charge':<12}{'conc.':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>5}"
+          f"{'lag moy':>9}{'lag p99':>9}{'RSS Mo':>8}")
+    for run in runs:
+        line = (f"{run['scenario']:<12}{run['concurrency']:>6}{run['throughput_rps']:>9}{run['p50_ms']!s:>10}"
+                f"{run['p95_ms']!s:>10}{run['p99_ms']!s:>10}{run['errors']:>5}{run['loop_lag']['mean_ms']!s:>9}"
+                f"{run['loop_lag']['p99_ms']!s:>9}{run['peak_rss_mb']:>8}")
+        old = (reference or {}).get((run["scenario"], run["concurrency"]))
+        if old and old["p95_ms"] and run["p95_ms"]:
+            line += f"   p95 {100 * (run['p95_ms'] / old['p95_ms'] - 1):+.0f} %, débit {100 * (run['throughput_rps'] / old['throughput_rps'] - 1):+.0f} %"
+        print(line)
+
+
+async def run(args):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    fake = start_process([
+        "-m", "benchmarks.fake_providers", "--port", str(args.fake_port),
+        "--groq-latency", str(args.groq_latency), "--groq-sigma", str(args.groq_sigma),
+        "--perplexity-latency", str(args.perplexity_latency), "--perplexity-sigma", str(args.perplexity_sigma),
+        "--error-rate", str(args.error_rate), "--seed", "42",
+    ], os.path.join(workdir, "fake_providers.log"))
+    app_env = {
+        "GROQ_API_KEY": "bench", "GROQ_BASE_URL": fake_url,
+        "PERPLEXITY_API_KEY": "bench", "PERPLEXITY_URL": f"{fake_url}/chat/completions",
+        "DIAG_CACHE_SIZE": "0", "DIAG_CACHE_PATH": "", "SOMFY_CATALOGUE_DB": "",
+        # Bases hors de l'arbre de travail ; pas de précalcul de fond pendant la mesure
+        "JOBS_DB": os.path.join(workdir, "jobs.db"), "CASES_DB": os.path.join(workdir, "cases.db"),
+        "PRECALCUL_DB": os.path.join(workdir, "precalcul.db"), "PRECALCUL_RPM": "0",
+    }
+    app = start_process(["-m", "uvicorn", "app:app", "--port", str(args.app_port), "--log-level", "warning"],
+                        os.path.join(workdir, "app.log"), app_env)
+    try:
+        await wait_ready(f"{fake_url}/stats", fake)
+        await wait_ready(f"{app_url}/stats", app)
+        photos = {"photo_3mo": synthetic_photo(3_000_000), "photo_10mo": synthetic_photo(10_000_000)}
+        runs = []
+        limits = httpx.Limits(max_connections=max(args.levels), max_keepalive_connections=max(args.levels))
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=120) as client:
+            for concurrency in args.levels:
+                for scenario in args.scenarios:
+                    result = await run_level(client, args.endpoint, scenario, concurrency,
+                                             max(args.requests, concurrency), photos)
+                    runs.append(result)
+                    print(f"  {scenario} x {concurrency} : {result['throughput_rps']} req/s, "
+                          f"p95 {result['p95_ms']} ms, {result['errors']} erreur(s)", flush=True)
+    finally:
+        for proc in (app, fake):
+            proc.terminate()
+            proc.wait(timeout=10)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=lambda v: [int(x) for x in v.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=20, help="requêtes par charge et par niveau")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=SCENARIOS)
+    parser.add_argument("--endpoint", default="/diagnostic", help="ou /diagnostic/stream")
+    parser.add_argument("--groq-latency", type=float, default=0.8)
+    parser.add_argument("--groq-sigma", type=float, default=0.3)
+    parser.add_argument("--perplexity-latency", type=float, default=1.0)
+    parser.add_argument("--perplexity-sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--app-port", type=int, default=9200)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--output", help="fichier JSON (défaut : benchmarks/results/load-<commit>-<date>.json)")
+    parser.add_argument("--compare", help="résultats précédents à comparer (JSON produit par ce script)")
+    args = parser.parse_args()
+
+    reference = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            reference = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["runs"]}
+
+    runs = asyncio.run(run(args))
+    print_table(runs, reference)
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "config": config, "runs": runs}, f, indent=2, ensure_ascii=False)
+    print(f"Résultats : {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark de l'index produit sur un catalogue synthétique.
+
+Usage : python -m benchmarks.bench_search_index [--products 50000] [--queries 2000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from utils.search_index import ProductIndex
+
+FAMILIES = ["Animeo", "Smoove", "Oximo", "Sunea", "Altus", "Telis", "Situo", "Centralis", "Soliris", "Inis",
+            "Chronis", "Glydea", "Sonesse", "Maestria", "Ilmo", "Orea", "Keytis", "Axroll", "Elixo", "Dexxo"]
+TYPES = ["Moteur radio RTS", "Commande murale IB+", "Séparateur de zone IB/IB+", "Capteur soleil-vent",
+         "Récepteur io-homecontrol", "Alimentation 16V SELV", "Motor controller 4 AC", "Horloge programmable"]
+SPEC_WORDS = ["tension", "entrée", "sortie", "bus", "relais", "boîtier", "IP65", "230V", "16V", "io", "RTS",
+              "sous-zone", "bornier", "couple", "Nm", "fin de course", "LED", "priorité", "vent", "soleil"]
+
+
+def synthetic_catalogue(n: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    products = {}
+    while len(products) < n:
+        ref = str(rng.randint(1_000_000, 9_999_999))
+        products[ref] = {
+            "name": f"{rng.choice(FAMILIES)} {rng.choice(['Pro', 'Origin', 'RTS', 'io', 'WireFree', 'Plus'])} {rng.randint(1, 99)}",
+            "type": rng.choice(TYPES),
+            "norms": "CE, 16V SELV",
+            "specs": "\n".join("- " + " ".join(rng.sample(SPEC_WORDS, 4)) for _ in range(4)),
+            "connections": "- IB+ in / C\n- " + " ".join(rng.sample(SPEC_WORDS, 3)),
+            "use_cases": "Gestion stores/volets tertiaire",
+        }
+    return products
+
+
+def typo(ref: str, rng: random.Random) -> str:
+    """Référence saisie à la main : un chiffre remplacé ou deux chiffres voisins inversés."""
+    i = rng.randrange(len(ref) - 1)
+    if rng.random() < 0.5:
+        return ref[:i] + ref[i + 1] + ref[i] + ref[i + 2:]
+    return ref[:i] + str((int(ref[i]) + 1) % 10) + ref[i + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    products = synthetic_catalogue(args.products)
+    start = time.perf_counter()
+    index = ProductIndex(products)
+    print(f"Index : {len(products)} produits, {len(index.vocabulary)} termes, construit en {time.perf_counter() - start:.2f} s")
+
+    rng = random.Random(7)
+    refs = list(products)
+    workloads = {
+        "référence exacte": lambda: rng.choice(refs),
+        "préfixe de référence": lambda: rng.choice(refs)[:5],
+        "référence avec faute": lambda: typo(rng.choice(refs), rng),
+        "nom sans accents": lambda: products[rng.choice(refs)]["name"].lower(),
+        "description de panne": lambda: f"{rng.choice(FAMILIES)} plus de {rng.choice(SPEC_WORDS)} sur le bus",
+    }
+    print(f"{'requête':<24}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for label, make_query in workloads.items():
+        queries = [make_query() for _ in range(args.queries)]
+        timings = []
+        for q in queries:
+            t = time.perf_counter()
+            index.search(q, args.k)
+            timings.append((time.perf_counter() - t) * 1000)
+        q = statistics.quantiles(timings, n=100)
+        print(f"{label:<24}{q[49]:>10.3f}{q[94]:>10.3f}{q[98]:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Faux Groq / Perplexity locaux pour mesurer le service sans consommer de crédits.
+
+Latence log-normale (médiane, dispersion), taux d'erreur (429 / 500) et réponses streamées (SSE) paramétrables.
+Usage : python -m benchmarks.fake_providers --port 9100 [--groq-latency 1.2 --groq-sigma 0.3 --error-rate 0.02]
+puis lancer l'application avec GROQ_BASE_URL=http://127.0.0.1:9100 PERPLEXITY_URL=http://127.0.0.1:9100/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+VISION_REPORT = (
+    "## 🆔 Identification précise\nAnimeo Switch Zone Splitter 1810392, boîtier IP65, bornier IB+ visible.\n"
+    "## 🔍 Analyse visuelle et technique\nLED verte éteinte, tension IB+ absente en entrée : alimentation 16 V DC à contrôler.\n"
+    "## 🛠️ Correction étape par étape\n1. Couper l'alimentation.\n2. Mesurer 16 V DC entre IB+ in et C.\n"
+    "3. Resserrer le bornier.\n4. Réalimenter et vérifier la LED.\n"
+    "## 💾 Enrichissement Base & Docs\nNotice d'installation 1810392, fiche Somfy Pro."
+)
+WEB_ANSWER = "**Solution** : vérifier l'alimentation 16 V SELV du bus IB+, puis les sous-zones une par une."
+
+
+class Profile:
+    """Latence log-normale autour de `median` secondes ; `error_rate` des réponses échouent (un tiers en 429)."""
+
+    def __init__(self, median: float, sigma: float, error_rate: float, seed: int = None):
+        self.median, self.sigma, self.error_rate = median, sigma, error_rate
+        self.rng = random.Random(seed)
+
+    def latency(self) -> float:
+        return self.median * math.exp(self.sigma * self.rng.gauss(0, 1))
+
+    def error(self):
+        if self.rng.random() >= self.error_rate: return None
+        if self.rng.random() < 1 / 3:
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429, headers={"retry-after": "0.2"})
+        return JSONResponse({"error": {"message": "upstream failure"}}, status_code=500)
+
+
+def completion(model: str, content: str, prompt_tokens: int) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                  "total_tokens": prompt_tokens + len(content) // 4},
+    }
+
+
+def prompt_tokens(body: dict) -> int:
+    """Estimation grossière : 4 caractères par token de texte, forfait par image."""
+    total = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            total += len(part.get("text", "")) // 4 if part.get("type") == "text" else 1_600
+    return total
+
+
+async def stream_completion(model: str, content: str, duration: float, tokens: int):
+    """Fragments SSE au format OpenAI/Groq répartis sur `duration` s ; l'usage arrive dans x_groq du dernier."""
+    words = content.split(" ")
+    delay = duration / max(len(words), 1)
+    cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    for i, word in enumerate(words):
+        await asyncio.sleep(delay)
+        chunk = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                 "choices": [{"index": 0, "delta": {"content": word + (" " if i < len(words) - 1 else "")},
+                              "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    last = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": cid, "usage": {"prompt_tokens": tokens, "completion_tokens": len(content) // 4,
+                                            "total_tokens": tokens + len(content) // 4}}}
+    yield f"data: {json.dumps(last)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def create_app(groq: Profile, perplexity: Profile) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = {"groq": 0, "perplexity": 0}
+
+    @app.post("/openai/v1/chat/completions")
+    async def groq_completions(request: Request):
+        body = await request.json()
+        app.state.requests["groq"] += 1
+        error = groq.error()
+        latency = groq.latency()
+        tokens = prompt_tokens(body)
+        if body.get("stream") and error is None:
+            # Le premier fragment arrive après ~20 % de la latence, le reste s'étale sur la génération
+            await asyncio.sleep(latency * 0.2)
+            return StreamingResponse(stream_completion(body.get("model", ""), VISION_REPORT, latency * 0.8, tokens),
+                                     media_type="text/event-stream")
+        await asyncio.sleep(latency)
+        return error or completion(body.get("model", ""), VISION_REPORT, tokens)
+
+    @app.post("/chat/completions")
+    async def perplexity_completions(request: Request):
+        body = await request.json()
+        app.state.requests["perplexity"] += 1
+        error = perplexity.error()
+        await asyncio.sleep(perplexity.latency())
+        return error or completion(body.get("model", ""), WEB_ANSWER, prompt_tokens(body))
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--groq-latency", type=float, default=1.2, help="médiane (s)")
+    parser.add_argument("--groq-sigma", type=float, default=0.3, help="dispersion log-normale")
+    parser.add_argument("--perplexity-latency", type=float, default=2.0, help="médiane (s)")
+    parser.add_argument("--perplexity-sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="part des réponses en 429/500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    app = create_app(
+        Profile(args.groq_latency, args.groq_sigma, args.error_rate, args.seed),
+        Profile(args.perplexity_latency, args.perplexity_sigma, args.error_rate, args.seed),
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
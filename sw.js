@@ -1,4 +1,41 @@
-// Service Worker minimal pour permettre l'installation PWA
-self.addEventListener('fetch', function(event) {
-    // On pourrait ajouter ici la gestion du mode hors-ligne plus tard
-});
\ No newline at end of file
+// Service Worker : coque de l'application et lecteur de codes-barres disponibles hors réseau
+// La version du cache est injectée au démarrage du serveur (empreinte de la page) : chaque déploiement vide l'ancien cache
+const CACHE = 'somfy-shell-__VERSION__';
+const SHELL = ['/', '/manifest.json'];
+const QRCODE = 'https://unpkg.com/html5-qrcode';
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(caches.open(CACHE).then(async (cache) => {
+        await cache.addAll(SHELL);
+        // Le CDN peut être injoignable à l'installation : la coque reste utilisable, le scanner sera mis en cache plus tard
+        try { await cache.add(QRCODE); } catch (e) {}
+    }).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(caches.keys().then((keys) => Promise.all(
+        keys.filter((k) => k.startsWith('somfy-shell-') && k !== CACHE).map((k) => caches.delete(k))
+    )).then(() => self.clients.claim()));
+});
+
+// Coque et scanner : réponse immédiate depuis le cache, mise à jour en arrière-plan (revalidation ETag côté serveur)
+self.addEventListener('fetch', (event) => {
+    const req = event.request;
+    if (req.method !== 'GET') return;
+    const url = new URL(req.url);
+    const isShell = url.origin === location.origin && SHELL.includes(url.pathname);
+    if (!isShell && !req.url.startsWith(QRCODE)) return;
+    const key = isShell ? url.pathname : req;
+    event.respondWith(caches.open(CACHE).then(async (cache) => {
+        const cached = await cache.match(key);
+        const network = fetch(req).then((res) => {
+            if (res.ok) cache.put(key, res.clone());
+            return res;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(() => {}));
+            return cached;
+        }
+        return network;
+    }));
+});
@@ -0,0 +1,58 @@
+"""Environnement de test : bases SQLite temporaires, pas de cache ni de précalcul, fournisseurs simulés."""
+import asyncio
+import os
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # manifest.json et sw.js sont lus au démarrage
+
+_TMP = tempfile.mkdtemp(prefix="somfy_tests_")
+for name, value in {
+    "JOBS_DB": os.path.join(_TMP, "jobs.db"), "CASES_DB": os.path.join(_TMP, "cases.db"),
+    "PRECALCUL_DB": os.path.join(_TMP, "precalcul.db"), "PRECALCUL_RPM": "0",
+    "DIAG_CACHE_SIZE": "0", "DIAG_CACHE_PATH": "", "SOMFY_CATALOGUE_DB": "",
+    "GROQ_API_KEY": "", "PERPLEXITY_API_KEY": "",
+}.items():
+    os.environ[name] = value
+
+
+class FakeGroq:
+    """Client Groq minimal : chaque appel attend `latency` s puis renvoie `content` (en fragments si stream=True) ou lève `error`."""
+
+    def __init__(self, latency: float = 0.0, content: str = "## Analyse\nTension IB+ à mesurer.", error: Exception = None):
+        self.api_key = "test"
+        self.latency = latency
+        self.content = content
+        self.error = error
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error: raise self.error
+        if stream: return self._chunks()
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    async def _chunks(self):
+        for line in self.content.splitlines(keepends=True):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=line))])
+
+    async def close(self):
+        pass
+
+
+@asynccontextmanager
+async def running_app(groq=None):
+    """Application démarrée (lifespan) avec un faux Groq ; yield un client httpx branché en ASGI."""
+    import httpx
+    from app import app
+    async with app.router.lifespan_context(app):
+        app.state.groq = groq
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client
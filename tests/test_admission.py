@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+from conftest import running_app
+from utils.admission import COMPLET, RAPIDE, AdmissionController, Surcharge
+
+
+def test_fast_requests_overtake_and_excess_is_shed():
+    async def scenario():
+        ac = AdmissionController(2, 3, 1.0)
+        ac._service[COMPLET] = 0.2
+        order, results = [], []
+
+        async def job(name, priority):
+            try:
+                async with ac.slot(priority):
+                    order.append(name)
+                    await asyncio.sleep(0.2 if priority == COMPLET else 0.01)
+                results.append(200)
+            except Surcharge as e:
+                results.append((503, e.retry_after))
+
+        tasks = [asyncio.create_task(job(f"complet{i}", COMPLET)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(job("rapide", RAPIDE)))
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.create_task(job(f"tard{i}", COMPLET)) for i in range(3)]
+        await asyncio.gather(*tasks)
+        return ac, order, results
+
+    ac, order, results = asyncio.run(scenario())
+    assert order.index("rapide") == 2  # première place libérée
+    assert results.count(200) == 5  # 2 en cours + 3 en file, les suivants refusés (file pleine)
+    assert all(r[1] >= 1 for r in results if r != 200)
+    assert ac.inflight == 0 and ac.queued() == 0
+
+
+def test_known_reference_is_fast_only_when_served_from_the_card():
+    photo = SimpleNamespace(filename="photo.jpg")
+
+    async def scenario():
+        async with running_app():
+            from app import priorite
+            desc = "Référence : 1810392\nLED rouge"
+            return priorite(photo, desc, card_only=True), priorite(photo, desc), priorite(None, desc)
+
+    assert asyncio.run(scenario()) == (RAPIDE, COMPLET, COMPLET)
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from conftest import FakeGroq, running_app
+from utils.cache import DiagnosticCache, cache_key
+
+
+def test_equivalent_descriptions_share_a_key():
+    assert cache_key(None, "Volet bloqué  en bas !") == cache_key(None, "volet BLOQUE en bas")
+    assert cache_key(b"photo", "Volet bloqué") != cache_key(None, "Volet bloqué")
+
+
+def test_entries_expire_after_ttl():
+    cache = DiagnosticCache(8, ttl=0.05)
+    cache.set("a", "<p>a</p>")
+    assert cache.get("a") == "<p>a</p>" and cache.contains("a")
+    time.sleep(0.1)
+    assert not cache.contains("a")
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_least_recently_read_entry_is_evicted():
+    cache = DiagnosticCache(2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_store_is_capped_and_reloaded(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = DiagnosticCache(2, path=path)
+    for key in "abc":
+        cache.set(key, key.upper())
+        time.sleep(0.01)  # dates d'accès distinctes
+    assert cache._db.execute("SELECT COUNT(*) FROM diag_cache").fetchone()[0] == 2
+    cache.close()
+
+    reloaded = DiagnosticCache(2, path=path)
+    assert (reloaded.get("a"), reloaded.get("b"), reloaded.get("c")) == (None, "B", "C")
+    assert reloaded.stats()["disk_hits"] == 2
+    reloaded.close()
+
+
+def test_expired_disk_entry_is_dropped(tmp_path):
+    path = str(tmp_path / "cache.db")
+    stored = DiagnosticCache(8, path=path)
+    stored.set("a", "A")
+    stored.close()
+    time.sleep(0.1)
+    cache = DiagnosticCache(8, ttl=0.05, path=path)
+    assert cache.get("a") is None
+    assert cache._db.execute("SELECT COUNT(*) FROM diag_cache").fetchone()[0] == 0
+    cache.close()
+
+
+def test_repeated_diagnostic_is_served_from_cache(monkeypatch):
+    import app
+    monkeypatch.setattr(app, "DIAG_CACHE_SIZE", 8)
+    groq = FakeGroq()
+
+    async def scenario():
+        async with running_app(groq) as client:
+            return [await client.post("/diagnostic", data={"panne_description": desc})
+                    for desc in ("Volet bloqué en bas", "volet bloque en bas !")]
+
+    first, second = asyncio.run(scenario())
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert second.text == first.text
+    assert groq.calls == 1
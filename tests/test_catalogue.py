@@ -0,0 +1,17 @@
+import asyncio
+
+from agents.agent_somfy_specialist import agent_somfy_specialist
+from utils import retrieval
+from utils.catalogue import CatalogueStore, read_dump
+
+
+def test_partial_csv_dump_gives_usable_products(tmp_path):
+    dump = tmp_path / "export.csv"
+    dump.write_text("ref,name,type\n9999001,Moteur test,Moteur filaire\n", encoding="utf-8")
+    store = CatalogueStore(str(tmp_path / "catalogue.db"))
+    assert store.import_products(read_dump(str(dump))) == 1
+    product = store.get("9999001")
+    assert product["norms"] == "" and product["documents"] == []
+    assert "Moteur test" in retrieval.format_context([("9999001", product)])
+    assert "Moteur test" in asyncio.run(agent_somfy_specialist("9999001", product))
+    store.close()
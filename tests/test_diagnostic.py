@@ -0,0 +1,110 @@
+import asyncio
+import re
+import time
+
+from conftest import FakeGroq, running_app
+
+
+def test_concurrent_diagnostics_take_about_one_upstream_call():
+    """N diagnostics simultanés partagent le client : durée totale ≈ un appel lent, pas N."""
+    latency, n = 0.5, 8
+    groq = FakeGroq(latency)
+
+    async def scenario():
+        async with running_app(groq) as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/diagnostic", data={"panne_description": f"Volet {i} bloqué en position basse"})
+                for i in range(n)
+            ])
+            return time.perf_counter() - start, responses
+
+    elapsed, responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [200] * n
+    assert groq.calls == n
+    assert elapsed < 2 * latency
+
+
+def test_budget_exhausted_while_vision_runs_still_renders(monkeypatch):
+    """Budget écoulé, vision encore en cours : rapport partiel, pas d'InvalidStateError."""
+    import app
+
+    async def slow_vision(messages):
+        await asyncio.sleep(2)
+        return "## Analyse"
+
+    async def web(query):
+        return "Notice trouvée"
+
+    monkeypatch.setattr(app, "DIAG_BUDGET", 0.2)
+    monkeypatch.setattr(app, "analyse_vision", slow_vision)
+    monkeypatch.setattr(app, "search_perplexity", web)
+    analysis, web_info, complete = asyncio.run(app.run_parallel([], "Volet bloqué"))
+    assert "Délai dépassé" in analysis
+    assert web_info == "Notice trouvée"
+    assert complete is False
+
+
+def test_hanging_provider_opens_the_circuit(monkeypatch):
+    """Groq ne répond plus : chaque diagnostic compte un échec malgré le délai de l'étape, le disjoncteur s'ouvre."""
+    import app
+    from utils import upstream
+
+    provider = upstream.Provider("groq", retries=2, backoff=0.01, attempt_timeout=0.1, breaker_threshold=2)
+    monkeypatch.setattr(upstream, "groq", provider)
+    monkeypatch.setattr(app, "GROQ_DEADLINE", 0.25)
+    monkeypatch.setattr(app, "DIAG_BUDGET", 0.5)
+
+    async def scenario():
+        async with running_app(FakeGroq(latency=5)):
+            return [await app.run_parallel([], "Volet bloqué") for _ in range(3)]
+
+    results = asyncio.run(scenario())
+    assert provider.breaker.state == "open"
+    assert provider.stats["failures"] == 2 and provider.stats["timeouts"] >= 2
+    assert "Délai dépassé" in results[0][0]
+    assert "suspendue" in results[2][0]
+
+
+def test_stream_exposes_case_id_only_once_the_case_is_stored():
+    async def scenario(groq, desc):
+        async with running_app(groq) as client:
+            r = await client.post("/diagnostic/stream", data={"panne_description": desc})
+            match = re.search(r"data-case-id='(\w+)'", r.text)
+            feedback = None
+            if match:
+                feedback = await client.post(f"/cas/{match.group(1)}/feedback", data={"verdict": "ok"})
+            return r, match, feedback
+
+    r, match, feedback = asyncio.run(scenario(FakeGroq(), "Store bloqué après un orage"))
+    assert "X-Case-Id" not in r.headers and match and feedback.status_code == 200
+
+    r, match, _ = asyncio.run(scenario(FakeGroq(error=RuntimeError("panne")), "Moteur muet au démarrage"))
+    assert r.status_code == 200 and match is None
+
+
+def test_rapport_escapes_the_reference_but_looks_up_the_raw_value(monkeypatch):
+    from agents import orchestrateur
+    lookups = []
+    monkeypatch.setattr(orchestrateur, "get_product_by_ref", lambda ref: lookups.append(ref))
+    reference = "<img src=x onerror=alert(1)>"
+
+    async def scenario():
+        async with running_app() as client:
+            return await client.post("/rapport", data={"reference": reference})
+
+    r = asyncio.run(scenario())
+    assert r.status_code == 200
+    assert "<img" not in r.text and "&lt;img" in r.text
+    assert lookups == [reference]
+
+
+def test_model_output_is_escaped_when_rendered():
+    groq = FakeGroq(content="## Analyse\n<img src=x onerror=alert(1)>\n")
+
+    async def scenario():
+        async with running_app(groq) as client:
+            return await client.post("/diagnostic", data={"panne_description": "Store bloqué, LED rouge"})
+
+    r = asyncio.run(scenario())
+    assert "<img" not in r.text and "&lt;img src=x" in r.text
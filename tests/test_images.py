@@ -0,0 +1,60 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from utils.images import ImageRejetee, prepare_image
+
+
+def encode(size, fmt="JPEG", orientation=None, **params):
+    img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        params["exif"] = exif
+    out = BytesIO()
+    img.save(out, fmt, **params)
+    return out.getvalue()
+
+
+def decoded_size(data):
+    with Image.open(BytesIO(data)) as img:
+        return img.size
+
+
+def test_exif_orientation_is_applied():
+    data, mime, _ = prepare_image(encode((80, 40), orientation=6), max_edge=200)
+    assert mime == "image/jpeg"
+    assert decoded_size(data) == (40, 80)
+    with Image.open(BytesIO(data)) as img:
+        assert img.getexif().get(0x0112, 1) == 1
+
+
+def test_large_photo_is_downscaled_to_max_edge():
+    data, _, stats = prepare_image(encode((640, 320), quality=95), max_edge=100)
+    assert decoded_size(data) == (100, 50)
+    assert stats["bytes_out"] < stats["bytes_in"]
+
+
+def test_small_upright_jpeg_is_kept_when_reencoding_would_grow_it():
+    raw = encode((64, 64), quality=20)
+    data, _, stats = prepare_image(raw, max_edge=200, quality=95)
+    assert data == raw
+    assert stats["saved"] == 0
+
+
+def test_png_with_transparency_is_flattened_to_jpeg():
+    img = Image.new("RGBA", (32, 32), (255, 0, 0, 0))
+    out = BytesIO()
+    img.save(out, "PNG")
+    data, mime, stats = prepare_image(out.getvalue(), max_edge=200)
+    assert stats["format"] == "PNG" and mime == "image/jpeg"
+    with Image.open(BytesIO(data)) as flat:
+        assert flat.format == "JPEG" and min(flat.getpixel((0, 0))) > 240  # fond blanc, pas le rouge transparent
+
+
+def test_unreadable_upload_is_rejected():
+    with pytest.raises(ImageRejetee) as e:
+        prepare_image(b"pas une image")
+    assert e.value.status_code == 415
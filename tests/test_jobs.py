@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from conftest import FakeGroq, running_app
+from utils.jobs import JobScheduler, JobStore, parse_batch
+from utils.upstream import TokenBucket
+
+
+def test_parse_batch_accepts_numeric_fields():
+    tickets = parse_batch(b'{"reference": 1810392, "panne_description": "LED rouge"}\n', "export.jsonl")
+    assert tickets == [{"reference": "1810392", "panne_description": "LED rouge", "image": ""}]
+
+
+@pytest.mark.parametrize("content", [
+    b'{"reference": "1810392"}\n["pas", "un", "objet"]\n',
+    b'{"reference": "1810392", "image_base64": "pas du base64 !"}\n',
+])
+def test_parse_batch_rejects_bad_rows(content):
+    with pytest.raises(ValueError):
+        parse_batch(content, "export.jsonl")
+
+
+@pytest.mark.parametrize("content", [
+    b'{"reference": 1810392, "panne_description": "LED rouge"}\n42\n',
+    b'{"reference": "1810392", "image_base64": "%%%"}\n',
+])
+def test_upload_of_bad_batch_is_a_400(content):
+    async def scenario():
+        async with running_app() as client:
+            return await client.post("/jobs", files={"fichier": ("export.jsonl", content)})
+
+    assert asyncio.run(scenario()).status_code == 400
+
+
+def test_ticket_with_failed_provider_is_reported_as_error():
+    async def scenario():
+        async with running_app(FakeGroq(error=RuntimeError("quota dépassé"))) as client:
+            batch = (await client.post("/jobs", files={"fichier": ("export.jsonl", b'{"panne_description": "Moteur muet"}\n')})).json()
+            for _ in range(100):
+                progress = (await client.get(f"/jobs/{batch['batch_id']}")).json()
+                if progress["complete"]: break
+                await asyncio.sleep(0.05)
+            return progress, (await client.get(f"/jobs/{batch['batch_id']}/results")).json()
+
+    progress, results = asyncio.run(scenario())
+    assert (progress["done"], progress["error"]) == (0, 1)
+    assert results[0]["status"] == "error" and "incomplet" in results[0]["error"]
+    assert "Erreur" in results[0]["html"]
+
+
+def _run_scheduler(tmp_path, tickets, providers, limiters, concurrency=4, wait=0.5):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    batch = store.create_batch(tickets)
+
+    async def runner(ticket):
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    async def scenario():
+        scheduler = JobScheduler(store, runner, concurrency, limiters, providers, poll=0.05)
+        scheduler.start()
+        await asyncio.sleep(wait)
+        progress = store.progress(batch)
+        await scheduler.stop()
+        return progress
+
+    progress = asyncio.run(scenario())
+    store.close()
+    return progress
+
+
+def test_cached_tickets_do_not_consume_tokens(tmp_path):
+    tickets = [{"reference": "", "panne_description": f"panne {i}", "image": ""} for i in range(8)]
+    limiters = {"groq": TokenBucket.per_minute(1), "perplexity": TokenBucket.per_minute(1)}
+    progress = _run_scheduler(tmp_path, tickets, lambda ticket: [], limiters)
+    assert progress["done"] == 8
+
+
+def test_tickets_waiting_for_tokens_stay_pending(tmp_path):
+    tickets = [{"reference": "", "panne_description": f"panne {i}", "image": ""} for i in range(6)]
+    limiters = {"groq": TokenBucket.per_minute(1, burst=2)}
+    progress = _run_scheduler(tmp_path, tickets, lambda ticket: ["groq"], limiters)
+    assert progress["done"] == 2
+    assert progress["running"] == 0
+    assert progress["pending"] == 4
+
+
+def test_throughput_scales_with_concurrency(tmp_path):
+    tickets = [{"reference": "", "panne_description": f"panne {i}", "image": ""} for i in range(8)]
+    limiters = {"groq": TokenBucket.per_minute(600, burst=8)}
+    assert _run_scheduler(tmp_path / "a", tickets, None, limiters, concurrency=8, wait=0.3)["done"] == 8
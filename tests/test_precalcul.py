@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from agents import precalcul
+from agents.precalcul import PrecalculStore, Precalculateur, etat, obtenir
+
+PRODUCT = {"name": "Animeo IB+", "specs": "16V DC"}
+
+
+class FakePerplexity:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.prompts = []
+
+    async def __call__(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        if self.error: raise self.error
+        return f"procédure {len(self.prompts)}"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = PrecalculStore(str(tmp_path / "precalcul.db"))
+    monkeypatch.setattr(precalcul, "store", store)
+    monkeypatch.setitem(precalcul.PROMPTS, "test", lambda ref, product: f"Procédure {ref} : {product['name']}")
+    yield store
+    store.close()
+
+
+def fake_perplexity(monkeypatch, error=None):
+    fake = FakePerplexity(error)
+    monkeypatch.setattr(precalcul, "call_perplexity", fake)
+    return fake
+
+
+def test_etat_tracks_prompt_product_and_age(store):
+    prompt = "Procédure 1810392"
+    assert etat(None, prompt, PRODUCT) == "absent"
+    store.put("test", "1810392", "contenu", precalcul.empreinte(prompt), precalcul.empreinte(PRODUCT))
+    entry = store.get("test", "1810392")
+    assert etat(entry, prompt, PRODUCT) == "frais"
+    assert etat(entry, prompt + " v2", PRODUCT) == "périmé"
+    assert etat(entry, prompt, {**PRODUCT, "specs": "24V DC"}) == "périmé"
+    assert etat({**entry, "created": entry["created"] - precalcul.PRECALCUL_REFRESH - 1}, prompt, PRODUCT) == "ancien"
+
+
+def test_absent_entry_is_generated_once_then_served(store, monkeypatch):
+    fake = fake_perplexity(monkeypatch)
+    first = asyncio.run(obtenir("test", "1810392", PRODUCT))
+    second = asyncio.run(obtenir("test", "1810392", PRODUCT))
+    assert first == second == "procédure 1"
+    assert len(fake.prompts) == 1
+    assert store.get("test", "1810392")["content"] == "procédure 1"
+
+
+def test_old_entry_is_served_without_waiting(store, monkeypatch):
+    fake = fake_perplexity(monkeypatch)
+    asyncio.run(obtenir("test", "1810392", PRODUCT))
+    monkeypatch.setattr(precalcul, "PRECALCUL_REFRESH", -1)
+    assert asyncio.run(obtenir("test", "1810392", PRODUCT)) == "procédure 1"
+    assert len(fake.prompts) == 1  # rafraîchi par le balayage de fond, pas à la demande
+
+
+def test_stale_entry_is_regenerated(store, monkeypatch):
+    fake = fake_perplexity(monkeypatch)
+    asyncio.run(obtenir("test", "1810392", PRODUCT))
+    assert asyncio.run(obtenir("test", "1810392", {**PRODUCT, "name": "Animeo IB+ v2"})) == "procédure 2"
+    assert len(fake.prompts) == 2
+
+
+def test_stale_entry_is_kept_when_perplexity_fails(store, monkeypatch):
+    fake_perplexity(monkeypatch)
+    asyncio.run(obtenir("test", "1810392", PRODUCT))
+    fake_perplexity(monkeypatch, error=RuntimeError("Perplexity indisponible"))
+    assert asyncio.run(obtenir("test", "1810392", {**PRODUCT, "name": "Animeo IB+ v2"})) == "procédure 1"
+    with pytest.raises(RuntimeError):
+        asyncio.run(obtenir("test", "9999999", PRODUCT))
+
+
+def test_sweep_generates_missing_entries_and_skips_fresh_ones(store, monkeypatch):
+    fake = fake_perplexity(monkeypatch)
+    monkeypatch.setattr(precalcul, "PROMPTS", {"test": precalcul.PROMPTS["test"]})
+    sweeper = Precalculateur(lambda: ["1810392", "inconnue"], lambda ref: PRODUCT if ref == "1810392" else None, None)
+    asyncio.run(sweeper.balayer())
+    asyncio.run(sweeper.balayer())
+    assert len(fake.prompts) == 1
+    assert precalcul.existant("test", "1810392") == "procédure 1"
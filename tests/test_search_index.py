@@ -0,0 +1,51 @@
+from utils.search_index import ProductIndex, tokenize
+
+PRODUCTS = {
+    "1810392": {"name": "Animeo IB+ Motor Controller 4AC", "type": "Contrôleur moteur", "specs": "Alimentation 16V DC",
+                "use_cases": "Brise-soleil tertiaire"},
+    "1822009": {"name": "Moteur Oximo io", "type": "Moteur radio", "specs": "Tube 50 mm",
+                "use_cases": "Volet roulant"},
+    "9019841": {"name": "Télécommande Situo 5 io", "type": "Télécommande", "specs": "5 canaux",
+                "use_cases": "Volet roulant, store"},
+}
+INDEX = ProductIndex(PRODUCTS)
+
+
+def refs(query, k=3):
+    return [ref for ref, _ in INDEX.search(query, k)]
+
+
+def test_tokens_are_lowercased_without_accents_or_stopwords():
+    assert tokenize("Référence : Télécommande pour le Volet") == ["telecommande", "volet"]
+
+
+def test_exact_reference_ranks_first():
+    assert refs("1810392")[0] == "1810392"
+
+
+def test_prefix_matches_partial_words():
+    assert refs("anim")[0] == "1810392"
+    assert refs("situ")[0] == "9019841"
+
+
+def test_accents_are_optional_in_queries():
+    assert refs("telecommande")[0] == "9019841"
+    assert refs("controleur")[0] == "1810392"
+
+
+def test_reference_with_one_typo_is_found():
+    assert refs("1810393")[0] == "1810392"  # chiffre erroné
+    assert refs("181092")[0] == "1810392"   # chiffre oublié
+
+
+def test_typo_tolerance_is_limited_to_references():
+    assert refs("moteru") == []
+
+
+def test_name_outweighs_type():
+    # « moteur » figure dans le nom de l'Oximo et seulement dans le type de l'Animeo
+    assert refs("moteur")[:2] == ["1822009", "1810392"]
+
+
+def test_every_query_word_adds_to_the_score():
+    assert refs("volet situo")[0] == "9019841"
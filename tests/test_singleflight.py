@@ -0,0 +1,59 @@
+import asyncio
+import gc
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_identical_requests_share_one_call():
+    flights, calls = SingleFlight(), []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "rapport"
+
+    async def scenario():
+        return await asyncio.gather(*[flights.do("clé", compute, 5) for _ in range(5)])
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["rapport"] * 5
+    assert sum(shared for _, shared in results) == 4
+
+
+def test_leader_outliving_ttl_still_gets_its_result():
+    """Calcul plus long que le ttl (mode séquentiel) : le meneur reçoit son résultat, le suiveur recalcule."""
+    flights, calls = SingleFlight(), []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return "rapport"
+
+    async def scenario():
+        leader = asyncio.create_task(flights.do("clé", compute, 0.1))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.do("clé", compute, 0.1))
+        return await leader, await follower
+
+    (leader, shared_leader), (follower, shared_follower) = asyncio.run(scenario())
+    assert (leader, shared_leader) == ("rapport", False)
+    assert (follower, shared_follower) == ("rapport", False)
+    assert len(calls) == 2
+
+
+def test_failing_leader_without_followers_logs_nothing(caplog):
+    flights = SingleFlight()
+
+    async def compute():
+        raise ValueError("photo refusée")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await flights.do("clé", compute, 5)
+
+    asyncio.run(scenario())
+    gc.collect()
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,47 @@
+import asyncio
+import gzip
+
+from conftest import running_app
+from utils.static import StaticAsset
+
+
+def get(path, headers):
+    async def scenario():
+        async with running_app() as client:
+            return await client.get(path, headers=headers)
+    return asyncio.run(scenario())
+
+
+def test_encoding_follows_accept_encoding():
+    asset = StaticAsset(b"<html></html>" * 100, "text/html")
+    asset.variants["br"] = b"br"  # brotli optionnel : variante simulée
+    assert asset.encoding_for("gzip, deflate, br") == "br"
+    assert asset.encoding_for("gzip;q=1.0, deflate") == "gzip"
+    assert asset.encoding_for("") == "identity"
+    del asset.variants["br"]
+    assert asset.encoding_for("br, gzip") == "gzip"
+
+
+def test_shell_is_served_gzipped_with_a_strong_etag():
+    r = get("/", {"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in r.headers["Vary"]
+    assert r.headers["ETag"].startswith('"') and "<html" in r.text.lower()
+
+    plain = get("/", {"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers and plain.text == r.text
+
+
+def test_matching_etag_gives_304_without_body():
+    etag = get("/sw.js", {}).headers["ETag"]
+    for match in (etag, f'"autre", W/{etag}', "*"):
+        r = get("/sw.js", {"If-None-Match": match, "Accept-Encoding": "gzip"})
+        assert r.status_code == 304 and r.content == b""
+        assert r.headers["ETag"] == etag
+    assert get("/sw.js", {"If-None-Match": '"autre"'}).status_code == 200
+
+
+def test_gzip_variant_decodes_to_the_original():
+    asset = StaticAsset("é".encode() * 1000, "text/plain")
+    assert gzip.decompress(asset.variants["gzip"]) == asset.variants["identity"]
+    assert asset.stats()["gzip"] < asset.stats()["identity"]
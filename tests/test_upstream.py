@@ -0,0 +1,142 @@
+"""Résilience des appels fournisseurs face à un faux Perplexity local (httpx.MockTransport) : erreurs, latence, disjoncteur."""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from utils import upstream
+from utils.upstream import CircuitOpenError, Provider
+
+OK = {"choices": [{"message": {"content": "réponse"}}]}
+
+
+class FakePerplexity:
+    """Rejoue une suite de réponses (code HTTP, en-têtes, latence) puis répond 200."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(time.monotonic())
+        status, headers, latency = self.script.pop(0) if self.script else (200, {}, 0)
+        await asyncio.sleep(latency)
+        return httpx.Response(status, headers=headers, json=OK if status == 200 else {"error": status})
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test")
+    provider = Provider("perplexity", retries=2, backoff=0.01, attempt_timeout=0.2, breaker_threshold=2,
+                        breaker_reset=0.1)
+    monkeypatch.setattr(upstream, "perplexity", provider)
+    return provider
+
+
+def call(fake, coro_factory=None):
+    async def scenario():
+        upstream.http_client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+        try:
+            return await (coro_factory() if coro_factory else upstream.call_perplexity("test"))
+        finally:
+            await upstream.http_client.aclose()
+            upstream.http_client = None
+    return asyncio.run(scenario())
+
+
+def test_503_is_retried(provider):
+    fake = FakePerplexity((503, {}, 0), (503, {}, 0))
+    assert call(fake) == "réponse"
+    assert len(fake.calls) == 3
+    assert provider.stats["retries"] == 2
+
+
+def test_429_waits_for_retry_after(provider):
+    fake = FakePerplexity((429, {"Retry-After": "0.3"}, 0))
+    assert call(fake) == "réponse"
+    assert fake.calls[1] - fake.calls[0] >= 0.3
+
+
+def test_slow_response_times_out_then_retries(provider):
+    fake = FakePerplexity((200, {}, 1.0))
+    assert call(fake) == "réponse"
+    assert provider.stats["timeouts"] == 1
+
+
+def test_4xx_is_not_retried(provider):
+    fake = FakePerplexity((400, {}, 0))
+    with pytest.raises(httpx.HTTPStatusError):
+        call(fake)
+    assert len(fake.calls) == 1
+    assert provider.breaker.state == "closed"
+
+
+def test_breaker_opens_then_closes_after_successful_probe(provider):
+    fake = FakePerplexity(*[(500, {}, 0)] * 6)
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            call(fake)
+    assert provider.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        call(fake)
+    calls_while_open = len(fake.calls)
+    time.sleep(0.15)
+    assert call(fake) == "réponse"  # requête d'essai : le fournisseur est revenu
+    assert len(fake.calls) == calls_while_open + 1
+    assert provider.breaker.state == "closed"
+
+
+def test_breaker_reopens_when_probe_fails(provider):
+    fake = FakePerplexity(*[(500, {}, 0)] * 9)
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            call(fake)
+    time.sleep(0.15)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(fake)
+    assert provider.breaker.state == "open"
+
+
+def _open_breaker(provider, fake):
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            call(fake)
+    time.sleep(0.15)
+    assert provider.breaker.state == "half-open"
+
+
+def test_cancelled_probe_does_not_leave_breaker_stuck(provider):
+    fake = FakePerplexity(*[(500, {}, 0)] * 6, (200, {}, 5))
+
+    async def cancelled_probe():
+        task = asyncio.create_task(upstream.call_perplexity("test"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    _open_breaker(provider, fake)
+    call(fake, cancelled_probe)
+    assert call(fake) == "réponse"  # nouvel essai accepté
+    assert provider.breaker.state == "closed"
+
+
+def test_probe_rejected_with_4xx_does_not_leave_breaker_stuck(provider):
+    fake = FakePerplexity(*[(500, {}, 0)] * 6, (401, {}, 0))
+    _open_breaker(provider, fake)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(fake)
+    assert call(fake) == "réponse"
+    assert provider.breaker.state == "closed"
+
+
+def test_hedged_request_takes_a_rate_limit_token(provider):
+    provider.hedge_after = 0.05
+    provider.rpm = 60  # un jeton par seconde, rafale d'un jeton
+    fake = FakePerplexity((200, {}, 0.15))
+    start = time.monotonic()
+    assert call(fake) == "réponse"
+    # Le doublement attend un jeton (~1 s) : la première requête répond avant et aucune seconde requête ne part
+    assert len(fake.calls) == 1
+    assert provider.stats["hedges"] == 0
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,127 @@
+"""Contrôle d'admission des diagnostics : places limitées, file d'attente bornée et prioritaire, rejet anticipé.
+
+Sans limite, une rafale (prise de poste) ralentit toutes les requêtes à la fois, empile les photos en mémoire et
+déclenche des 429 en cascade chez les fournisseurs. Ici, au-delà de `max_inflight` diagnostics en cours, les
+requêtes attendent par priorité (voie rapide d'abord) ; celles qui ne seraient pas servies avant `deadline` sont
+refusées tout de suite avec une estimation du délai (Retry-After) plutôt qu'après avoir attendu pour rien.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from utils import metrics
+
+RAPIDE, COMPLET, FOND = 0, 1, 2  # référence connue / rapport en cache, analyse vision complète, enrichissement
+NOMS = {RAPIDE: "rapide", COMPLET: "complet", FOND: "fond"}
+# Durée de service supposée tant qu'aucune requête de cette priorité n'a été mesurée
+SERVICE_INITIAL = {RAPIDE: 0.05, COMPLET: 5.0, FOND: 5.0}
+
+
+class Surcharge(Exception):
+    """Requête refusée faute de place ; retry_after (s) est le délai conseillé au client."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """Au plus `max_inflight` diagnostics simultanés (0 = pas de limite), `max_queue` en attente, `deadline` s d'attente."""
+
+    def __init__(self, max_inflight: int, max_queue: int, deadline: float):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.inflight = 0
+        self._queue = []  # tas de (priorité, ordre d'arrivée, future)
+        self._order = itertools.count()
+        self._running = Counter()
+        self._service = dict(SERVICE_INITIAL)  # moyenne glissante de la durée d'occupation par priorité
+        self.admitted = 0
+        self.shed = Counter()
+
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def estimate_wait(self, priority: int) -> float:
+        """Attente probable d'une nouvelle requête : rang dans la file divisé par le rythme de libération des places."""
+        ahead = sum(1 for p, _, _ in self._queue if p <= priority)
+        rate = sum(n / self._service[p] for p, n in self._running.items() if n > 0)
+        return (ahead + 1) / rate if rate else 0.0
+
+    def _refuse(self, reason: str, priority: int, retry_after: float):
+        self.shed[reason] += 1
+        metrics.ADMISSION_SHED.inc(reason=reason, priority=NOMS[priority])
+        raise Surcharge("Trop de diagnostics en cours, réessayez dans quelques secondes.", retry_after)
+
+    async def acquire(self, priority: int = COMPLET):
+        """Attend une place ; retourne la fonction (idempotente) qui la libère. Lève Surcharge si refusée."""
+        if self.max_inflight <= 0: return lambda: None
+        start = time.monotonic()
+        if self.inflight < self.max_inflight and not self._queue:
+            self.inflight += 1
+        else:
+            if len(self._queue) >= self.max_queue:
+                self._refuse("file_pleine", priority, self.estimate_wait(priority))
+            wait = self.estimate_wait(priority)
+            if wait > self.deadline:
+                self._refuse("delai_estime", priority, wait)
+            entry = (priority, next(self._order), asyncio.get_running_loop().create_future())
+            heapq.heappush(self._queue, entry)
+            try:
+                async with asyncio.timeout(self.deadline):
+                    await entry[2]
+            except BaseException as e:
+                if entry[2].done() and not entry[2].cancelled():
+                    self._handoff()  # place transmise au moment même de l'abandon : on la repasse
+                else:
+                    entry[2].cancel()
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                if isinstance(e, TimeoutError): self._refuse("attente", priority, self.estimate_wait(priority))
+                raise
+        metrics.ADMISSION_WAIT.observe(time.monotonic() - start, priority=NOMS[priority])
+        self.admitted += 1
+        self._running[priority] += 1
+        held = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if released: return
+            released = True
+            self._running[priority] -= 1
+            self._service[priority] = 0.8 * self._service[priority] + 0.2 * (time.monotonic() - held)
+            self._handoff()
+
+        return release
+
+    def _handoff(self):
+        """Place libérée : transmise à la requête en attente la plus prioritaire, sinon rendue."""
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = COMPLET):
+        release = await self.acquire(priority)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        waiting = Counter(NOMS[p] for p, _, _ in self._queue)
+        return {"max_inflight": self.max_inflight, "max_queue": self.max_queue, "deadline": self.deadline,
+                "in_flight": self.inflight, "queued": len(self._queue), "queued_by_priority": dict(waiting),
+                "admitted": self.admitted, "shed": dict(self.shed),
+                "service_s": {NOMS[p]: round(s, 3) for p, s in self._service.items()}}
@@ -0,0 +1,119 @@
+"""Cache des diagnostics rendus, adressé par contenu (image + description normalisée)."""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_description(text: str) -> str:
+    """Minuscules, sans accents ni espaces superflus : deux saisies équivalentes donnent la même clé."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text.casefold()).strip(" .!?")
+
+
+def cache_key(image_bytes: bytes, description: str) -> str:
+    """Empreinte SHA-256 des octets de l'image + description normalisée."""
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(image_bytes or b"").digest())
+    h.update(normalize_description(description).encode("utf-8"))
+    return h.hexdigest()
+
+
+class DiagnosticCache:
+    """LRU en mémoire avec TTL et taille maximale, doublé d'un stockage SQLite optionnel qui survit aux redémarrages."""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 86400, path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clé -> (html, date de création)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = self.misses = self.disk_hits = self.evictions = self.expired = 0
+        if path and max_entries > 0:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS diag_cache (key TEXT PRIMARY KEY, html TEXT, created REAL, accessed REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str):
+        if self.max_entries <= 0: return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self._db:
+                row = self._db.execute("SELECT html, created FROM diag_cache WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    self._db.execute("UPDATE diag_cache SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                if row:
+                    self._db.execute("DELETE FROM diag_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.expired += 1
+            self.misses += 1
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Présence en mémoire, sans toucher aux compteurs ni au disque (tri des requêtes à l'admission)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return bool(entry) and time.time() - entry[1] <= self.ttl
+
+    def set(self, key: str, html: str):
+        if self.max_entries <= 0: return
+        now = time.time()
+        with self._lock:
+            self._remember(key, html, now)
+            if self._db:
+                self._db.execute("INSERT OR REPLACE INTO diag_cache VALUES (?, ?, ?, ?)", (key, html, now, now))
+                # Même plafond sur disque : on supprime les entrées les moins récemment lues
+                self._db.execute(
+                    "DELETE FROM diag_cache WHERE key IN (SELECT key FROM diag_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, html: str, created: float):
+        self._entries[key] = (html, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk": self._db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
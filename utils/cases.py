@@ -0,0 +1,168 @@
+"""Base de cas : diagnostics terminés, retours des techniciens et recherche de pannes similaires.
+
+Les descriptions sont indexées en TF-IDF sur des n-grammes de caractères (3 à 5), robustes aux fautes de frappe et
+aux variantes (« pas de 16V sur IB+ » / « plus de 16 V sur le bus IB+ »). La similarité cosinus est calculée en
+NumPy sur une matrice creuse rangée par n-gramme : une requête ne lit que les colonnes de ses propres n-grammes.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from utils.cache import normalize_description
+
+NGRAMS = (3, 4, 5)
+
+
+def char_ngrams(text: str) -> Counter:
+    """N-grammes de caractères par mot (bornés par des espaces) de la description normalisée."""
+    grams = Counter()
+    for word in normalize_description(text).split():
+        w = f" {word} "
+        for n in NGRAMS:
+            for i in range(len(w) - n + 1):
+                grams[w[i:i + n]] += 1
+    return grams
+
+
+class CaseIndex:
+    """Index TF-IDF reconstruit paresseusement, au plus une fois toutes les `rebuild_every` s : un cas ajouté devient
+    cherchable à la reconstruction suivante, sans coût de reconstruction à chaque diagnostic."""
+
+    def __init__(self, rebuild_every: float = 30.0):
+        self.vocab = {}
+        self.docs = []  # par ligne : (identifiants de n-grammes, occurrences)
+        self.rebuild_every = rebuild_every
+        self._dirty = True
+        self._built_at = None
+
+    def add(self, text: str) -> int:
+        grams = char_ngrams(text)
+        ids = np.fromiter((self.vocab.setdefault(g, len(self.vocab)) for g in grams), np.int64, len(grams))
+        self.docs.append((ids, np.fromiter(grams.values(), np.float32, len(grams))))
+        self._dirty = True
+        return len(self.docs) - 1
+
+    def _build(self):
+        lengths = np.array([len(ids) for ids, _ in self.docs], np.int64)
+        rows = np.repeat(np.arange(len(self.docs)), lengths)
+        cols = np.concatenate([ids for ids, _ in self.docs])
+        tf = np.concatenate([tf for _, tf in self.docs])
+        df = np.bincount(cols, minlength=len(self.vocab))
+        self.idf = (np.log((1 + len(self.docs)) / (1 + df)) + 1).astype(np.float32)
+        data = (1 + np.log(tf)) * self.idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=len(self.docs)))
+        data = (data / np.maximum(norms, 1e-9)[rows]).astype(np.float32)
+        # Rangement par colonne (CSC) : postings du n-gramme j dans [indptr[j], indptr[j + 1])
+        order = np.argsort(cols, kind="stable")
+        self._rows, self._data = rows[order], data[order]
+        self._indptr = np.concatenate([[0], np.cumsum(df)])
+        self._dirty = False
+        self._built_at = time.monotonic()
+
+    def search(self, text: str, k: int = 5) -> list:
+        """[(ligne, similarité cosinus)] par similarité décroissante."""
+        if not self.docs: return []
+        if self._dirty and (self._built_at is None or time.monotonic() - self._built_at >= self.rebuild_every):
+            self._build()
+        cols, weights = [], []
+        for gram, count in char_ngrams(text).items():
+            col = self.vocab.get(gram)
+            if col is not None and col < len(self.idf):
+                cols.append(col)
+                weights.append((1 + np.log(count)) * self.idf[col])
+        if not cols: return []
+        weights = np.array(weights, np.float32)
+        spans = [np.arange(self._indptr[c], self._indptr[c + 1]) for c in cols]
+        postings = np.concatenate(spans)
+        q = np.repeat(weights / np.linalg.norm(weights), [len(span) for span in spans])
+        scores = np.bincount(self._rows[postings], weights=self._data[postings] * q, minlength=len(self.docs))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(int(i), float(scores[i])) for i in top[np.argsort(-scores[top])] if scores[i] > 0]
+
+
+class CaseBase:
+    """Cas persistés en SQLite (id = clé du cache de diagnostic), index de similarité gardé en mémoire."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS cases (
+                id TEXT PRIMARY KEY, created REAL, description TEXT, reference TEXT, sections TEXT, html TEXT,
+                feedback TEXT, note TEXT, updated REAL
+            )""")
+        self._db.commit()
+        self.index = CaseIndex()
+        self._meta = {}  # id -> {description, reference, feedback, created}
+        self._row_ids = []
+        for case_id, created, description, reference, feedback in self._db.execute(
+                "SELECT id, created, description, reference, feedback FROM cases ORDER BY created"):
+            self._remember(case_id, created, description, reference, feedback)
+        self.direct_answers = 0
+
+    def _remember(self, case_id, created, description, reference, feedback):
+        self._meta[case_id] = {"description": description, "reference": reference, "feedback": feedback,
+                               "created": created}
+        self.index.add(description)
+        self._row_ids.append(case_id)
+
+    def add(self, case_id: str, description: str, reference: str, sections: list, html: str):
+        """Enregistre un diagnostic terminé ; un cas déjà connu garde son retour technicien."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO cases (id, created, description, reference, sections, html, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET sections = excluded.sections, "
+                "html = excluded.html, updated = excluded.updated",
+                (case_id, now, description, reference, json.dumps(sections, ensure_ascii=False), html, now),
+            )
+            self._db.commit()
+            if case_id not in self._meta:
+                self._remember(case_id, now, description, reference, None)
+
+    def feedback(self, case_id: str, verdict: str, note: str = "") -> bool:
+        """Retour du technicien : « ok » valide le cas (réponse directe possible), « ko » l'écarte."""
+        with self._lock:
+            if case_id not in self._meta: return False
+            self._db.execute("UPDATE cases SET feedback = ?, note = ?, updated = ? WHERE id = ?",
+                             (verdict, note, time.time(), case_id))
+            self._db.commit()
+            self._meta[case_id]["feedback"] = verdict
+        return True
+
+    def get(self, case_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT description, reference, sections, html, feedback, note, created FROM cases WHERE id = ?",
+                (case_id,)).fetchone()
+        if not row: return None
+        description, reference, sections, html, feedback, note, created = row
+        return {"id": case_id, "description": description, "reference": reference, "sections": json.loads(sections),
+                "html": html, "feedback": feedback, "note": note, "created": created}
+
+    def similar(self, description: str, k: int = 3) -> list:
+        """[(id, similarité, métadonnées)] des cas les plus proches, hors cas rejetés par un technicien."""
+        with self._lock:
+            hits = self.index.search(description, k * 2)
+            out = []
+            for row, score in hits:
+                case_id = self._row_ids[row]
+                meta = self._meta[case_id]
+                if meta["feedback"] != "ko": out.append((case_id, score, meta))
+        return out[:k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            validated = sum(1 for m in self._meta.values() if m["feedback"] == "ok")
+            return {"cases": len(self._meta), "validated": validated, "direct_answers": self.direct_answers}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
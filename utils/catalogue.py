@@ -0,0 +1,181 @@
+"""Catalogue produit sur SQLite (FTS5 + mmap) : rien n'est chargé en mémoire au démarrage, seules les références
+consultées récemment sont gardées dans un LRU.
+
+Import en masse :
+    python -m utils.catalogue import export.csv --db catalogue.db
+    python -m utils.catalogue import export.json --db catalogue.db   (dict {réf: produit}, liste ou JSONL)
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+from functools import lru_cache
+
+from utils.search_index import FIELD_WEIGHTS, tokenize
+
+TEXT_FIELDS = ["name", "type", "specs", "connections", "use_cases", "norms"]
+
+
+def complete_product(product: dict) -> dict:
+    """Fiche avec tous les champs attendus par les agents et le prompt ("" ou [] si absents de l'export)."""
+    product = dict(product)
+    for field in TEXT_FIELDS:
+        if product.get(field) is None: product[field] = ""
+    if not product.get("documents"): product["documents"] = []
+    return product
+
+
+def _typo_variants(ref: str) -> set:
+    """Références à une faute de frappe près (chiffre remplacé ou deux caractères voisins inversés)."""
+    variants = set()
+    for i, c in enumerate(ref):
+        if c.isdigit():
+            variants |= {ref[:i] + d + ref[i + 1:] for d in "0123456789"}
+        if i + 1 < len(ref):
+            variants.add(ref[:i] + ref[i + 1] + c + ref[i + 2:])
+    variants.discard(ref)
+    return variants
+
+
+class CatalogueStore:
+    """Produits stockés en JSON par référence, index plein texte FTS5 sur les champs descriptifs."""
+
+    def __init__(self, path: str, seed: dict = None, cache_size: int = 2048, mmap_mb: int = 256):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute(f"PRAGMA mmap_size = {mmap_mb * 1024 * 1024}")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, ref TEXT UNIQUE NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            f"ref, {', '.join(TEXT_FIELDS)}, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self._db.commit()
+        self.get = lru_cache(maxsize=cache_size)(self._get)
+        if seed:
+            # La graine ne remplace jamais une fiche importée, elle complète seulement les références absentes
+            missing = [(ref, p) for ref, p in seed.items() if self._get(ref) is None]
+            if missing: self.import_products(missing)
+
+    def _get(self, reference: str):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM products WHERE ref = ?", (reference,)).fetchone()
+        # Fiches importées avant le complément à l'import : même normalisation à la lecture
+        return complete_product(json.loads(row[0])) if row else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def references(self, limit: int = 20) -> list:
+        with self._lock:
+            return [r for (r,) in self._db.execute("SELECT ref FROM products ORDER BY ref LIMIT ?", (limit,))]
+
+    def import_products(self, items, batch: int = 5000) -> int:
+        """Insère ou remplace des (référence, produit) par lots ; retourne le nombre de produits importés."""
+        total = 0
+        rows, fts = [], []
+        with self._lock:
+            for ref, product in items:
+                ref = str(ref).strip()
+                if not ref: continue
+                product = complete_product(product)
+                rows.append((ref, json.dumps(product, ensure_ascii=False)))
+                fts.append((ref, *[str(product.get(f, "")) for f in TEXT_FIELDS]))
+                if len(rows) >= batch:
+                    total += self._flush(rows, fts)
+                    rows, fts = [], []
+            total += self._flush(rows, fts)
+        self.get.cache_clear()
+        return total
+
+    def _flush(self, rows: list, fts: list) -> int:
+        # La ligne FTS partage le rowid du produit : remplacer une référence ne demande aucun parcours de l'index
+        marks = ", ".join("?" * (len(TEXT_FIELDS) + 2))
+        for (ref, data), fields in zip(rows, fts):
+            row = self._db.execute("SELECT id FROM products WHERE ref = ?", (ref,)).fetchone()
+            if row:
+                self._db.execute("DELETE FROM products_fts WHERE rowid = ?", row)
+                self._db.execute("UPDATE products SET data = ? WHERE id = ?", (data, row[0]))
+                rowid = row[0]
+            else:
+                rowid = self._db.execute("INSERT INTO products (ref, data) VALUES (?, ?)", (ref, data)).lastrowid
+            self._db.execute(f"INSERT INTO products_fts (rowid, ref, {', '.join(TEXT_FIELDS)}) VALUES ({marks})",
+                             (rowid, *fields))
+        self._db.commit()
+        return len(rows)
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Recherche classée BM25 (FTS5) avec préfixes ; retourne [(référence, produit, score)]."""
+        tokens = tokenize(query)
+        if not tokens: return []
+        weights = ", ".join(str(FIELD_WEIGHTS[f]) for f in ["ref"] + TEXT_FIELDS)
+        sql = (f"SELECT ref, -bm25(products_fts, {weights}) AS score FROM products_fts "
+               "WHERE products_fts MATCH ? ORDER BY score DESC LIMIT ?")
+        terms = [f'"{t}"*' for t in tokens]
+        with self._lock:
+            # Tous les mots d'abord (peu de lignes à classer), n'importe lequel ensuite
+            rows = self._db.execute(sql, (" AND ".join(terms), k)).fetchall()
+            if not rows and len(terms) > 1:
+                rows = self._db.execute(sql, (" OR ".join(terms), k)).fetchall()
+            if not rows:
+                # Référence tapée à la main avec une faute : on teste les variantes à un caractère près
+                variants = set().union(*[_typo_variants(t) for t in tokens if len(t) >= 4 and t.isdigit()])
+                if variants:
+                    marks = ", ".join("?" * len(variants))
+                    rows = [(r, 0.5) for (r,) in self._db.execute(
+                        f"SELECT ref FROM products WHERE ref IN ({marks}) LIMIT ?", (*variants, k))]
+        return [(ref, self.get(ref), score) for ref, score in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def read_dump(path: str):
+    """Lit un export CSV, JSON ou JSONL et produit des (référence, produit)."""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                ref = row.pop("ref", None) or row.pop("reference", None)
+                docs = row.get("documents")
+                row["documents"] = json.loads(docs) if docs else []
+                yield ref, row
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    product = json.loads(line)
+                    yield product.pop("ref", None) or product.pop("reference", None), product
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            yield from data.items()
+        else:
+            for product in data:
+                yield product.pop("ref", None) or product.pop("reference", None), product
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestion du catalogue produit SQLite")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Importer un export CSV / JSON / JSONL")
+    imp.add_argument("dump")
+    imp.add_argument("--db", default=os.environ.get("SOMFY_CATALOGUE_DB", "catalogue.db"))
+    args = parser.parse_args(argv)
+
+    store = CatalogueStore(args.db)
+    n = store.import_products(read_dump(args.dump))
+    print(f"{n} produits importés, {store.count()} au total dans {args.db}")
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
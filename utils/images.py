@@ -0,0 +1,79 @@
+"""Préparation des photos avant envoi au modèle vision (taille, orientation, format)."""
+import logging
+import time
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Compteurs cumulés exposés par /stats
+STATS = {"images": 0, "bytes_in": 0, "bytes_out": 0, "ms": 0.0}
+
+
+class ImageRejetee(Exception):
+    """Photo refusée (trop lourde ou illisible) ; status_code est le code HTTP à renvoyer."""
+
+    def __init__(self, message: str, status_code: int = 415):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def read_upload(upload, max_bytes: int) -> bytes:
+    """Lit l'upload par blocs en refusant tout fichier au-delà de max_bytes."""
+    buf = bytearray()
+    while True:
+        chunk = await upload.read(1024 * 1024)
+        if not chunk: break
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise ImageRejetee(f"Photo trop lourde (limite {max_bytes // (1024 * 1024)} Mo).", 413)
+    return bytes(buf)
+
+
+def prepare_image(raw: bytes, max_edge: int = 1568, quality: int = 85):
+    """Redresse (EXIF), réduit au bord maximal et réencode en JPEG.
+
+    Retourne (octets, type MIME, statistiques). Fonction bloquante : à exécuter dans un pool de workers.
+    """
+    start = time.perf_counter()
+    try:
+        with Image.open(BytesIO(raw)) as img:
+            fmt = img.format or "inconnu"
+            resized = max(img.size) > max_edge
+            # Décodage JPEG directement à échelle réduite : bien moins de mémoire pour une photo 12 Mpx
+            img.draft("RGB", (max_edge, max_edge))
+            rotated = img.getexif().get(0x0112, 1) != 1
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            out = BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True)
+    except (OSError, Image.DecompressionBombError, ValueError) as e:
+        raise ImageRejetee(f"Image illisible ou format non supporté ({e}).") from e
+
+    data = out.getvalue()
+    # Un JPEG déjà petit et droit peut grossir au réencodage : on garde alors l'original
+    if fmt == "JPEG" and not resized and not rotated and len(data) >= len(raw):
+        data = raw
+    stats = {
+        "format": fmt,
+        "bytes_in": len(raw),
+        "bytes_out": len(data),
+        "saved": len(raw) - len(data),
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    STATS["images"] += 1
+    STATS["bytes_in"] += stats["bytes_in"]
+    STATS["bytes_out"] += stats["bytes_out"]
+    STATS["ms"] = round(STATS["ms"] + stats["ms"], 1)
+    logger.info("Image %s : %d -> %d octets (%d économisés) en %.1f ms",
+                fmt, stats["bytes_in"], stats["bytes_out"], stats["saved"], stats["ms"])
+    return data, "image/jpeg", stats
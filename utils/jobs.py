@@ -0,0 +1,242 @@
+"""Diagnostics en lot : file persistante (SQLite) et ordonnanceur à concurrence bornée."""
+import asyncio
+import base64
+import binascii
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class IncompleteReport(Exception):
+    """Rapport rendu mais incomplet (fournisseur en échec, délai dépassé) : gardé, le ticket passe en erreur."""
+
+    def __init__(self, html: str, reason: str = "rapport incomplet (fournisseur en échec ou délai dépassé)"):
+        super().__init__(reason)
+        self.html = html
+
+def _field(row: dict, *names) -> str:
+    """Première colonne renseignée, en texte (un export JSON peut donner la référence sous forme de nombre)."""
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ""): return str(value).strip()
+    return ""
+
+
+def parse_batch(content: bytes, filename: str = "") -> list:
+    """Lit un export GMAO (JSONL ou CSV) et retourne des tickets {reference, panne_description, image}.
+    Lève ValueError (ligne fautive en clair) si le fichier est illisible."""
+    text = content.decode("utf-8-sig")
+    is_jsonl = filename.endswith(".jsonl") or (not filename.endswith(".csv") and text.lstrip().startswith("{"))
+    if is_jsonl:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    tickets = []
+    for n, row in enumerate(rows, 1):
+        if not isinstance(row, dict): raise ValueError(f"ticket {n} : objet JSON attendu")
+        image = _field(row, "image_base64", "image")
+        if image:
+            try:
+                base64.b64decode(image, validate=True)
+            except binascii.Error as e:
+                raise ValueError(f"ticket {n} : image_base64 invalide ({e})") from e
+        tickets.append({
+            "reference": _field(row, "reference", "ref"),
+            "panne_description": _field(row, "panne_description", "description"),
+            "image": image,
+        })
+    return tickets
+
+
+def ticket_description(ticket: dict) -> str:
+    """Description envoyée au pipeline : la référence est présentée comme un scan pour profiter du même traitement."""
+    desc = ticket["panne_description"]
+    if ticket["reference"] and ticket["reference"] not in desc:
+        desc = f"Référence : {ticket['reference']}\n{desc}".strip()
+    return desc
+
+
+def ticket_image(ticket: dict):
+    return base64.b64decode(ticket["image"]) if ticket.get("image") else None
+
+
+class JobStore:
+    """Lots et tickets en SQLite : un redémarrage remet simplement les tickets « running » en attente."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, created REAL, total INTEGER);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY, batch_id TEXT, idx INTEGER, payload TEXT,
+                status TEXT DEFAULT 'pending', result TEXT, error TEXT, started REAL, finished REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, idx);
+        """)
+        self._db.execute("UPDATE jobs SET status = 'pending', started = NULL WHERE status = 'running'")
+        self._db.commit()
+
+    def create_batch(self, tickets: list) -> str:
+        batch_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._db.execute("INSERT INTO batches VALUES (?, ?, ?)", (batch_id, time.time(), len(tickets)))
+            self._db.executemany(
+                "INSERT INTO jobs (batch_id, idx, payload) VALUES (?, ?, ?)",
+                [(batch_id, i, json.dumps(t, ensure_ascii=False)) for i, t in enumerate(tickets)],
+            )
+            self._db.commit()
+        return batch_id
+
+    def next_pending(self):
+        """Plus ancien ticket en attente (id, payload), sans le réserver, ou None."""
+        with self._lock:
+            row = self._db.execute("SELECT id, payload FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def claim(self, job_id: int) -> bool:
+        """Passe le ticket à « running » ; False s'il n'était plus en attente."""
+        with self._lock:
+            cur = self._db.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'pending'",
+                                   (time.time(), job_id))
+            self._db.commit()
+        return cur.rowcount == 1
+
+    def finish(self, job_id: int, result: str = None, error: str = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                ("error" if error else "done", result, error, time.time(), job_id),
+            )
+            self._db.commit()
+
+    def progress(self, batch_id: str):
+        with self._lock:
+            batch = self._db.execute("SELECT created, total FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if not batch: return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY status", (batch_id,)))
+        finished = counts.get("done", 0) + counts.get("error", 0)
+        return {
+            "batch_id": batch_id,
+            "created": batch[0],
+            "total": batch[1],
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "error": counts.get("error", 0),
+            "percent": round(100 * finished / batch[1], 1) if batch[1] else 100.0,
+            "complete": finished == batch[1],
+        }
+
+    def results(self, batch_id: str, offset: int = 0, limit: int = 100) -> list:
+        """Tickets terminés (succès ou erreur) du lot, dans l'ordre du fichier."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, payload, status, result, error, started, finished FROM jobs "
+                "WHERE batch_id = ? AND status IN ('done', 'error') ORDER BY idx LIMIT ? OFFSET ?",
+                (batch_id, limit, offset),
+            ).fetchall()
+        out = []
+        for idx, payload, status, result, error, started, finished in rows:
+            ticket = json.loads(payload)
+            out.append({
+                "index": idx,
+                "reference": ticket["reference"],
+                "panne_description": ticket["panne_description"],
+                "status": status,
+                "html": result,
+                "error": error,
+                "duration_ms": round((finished - started) * 1000) if started and finished else None,
+            })
+        return out
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobScheduler:
+    """`concurrency` workers qui dépilent la file et appellent `runner(ticket)` (coroutine retournant le HTML, ou
+    levant IncompleteReport pour un rapport partiel à relancer).
+
+    Avant d'être réservé, un ticket prend un jeton du limiteur de chaque fournisseur qu'il appellera réellement
+    (`providers(ticket)`, tous par défaut) : un lot de campagne ne peut pas épuiser à lui seul les quotas Groq /
+    Perplexity du trafic interactif, mais un rapport déjà en cache ne consomme rien et part tout de suite.
+    """
+
+    def __init__(self, store: JobStore, runner, concurrency: int = 4, limiters: dict = None, providers=None,
+                 poll: float = 2.0):
+        self.store = store
+        self.runner = runner
+        self.concurrency = concurrency
+        self.limiters = {name: l for name, l in (limiters or {}).items() if l}
+        self.providers = providers or (lambda ticket: self.limiters)
+        self.poll = poll
+        self._wakeup = asyncio.Event()
+        self._dispatch = asyncio.Lock()  # un seul worker à la fois attend des jetons pour le ticket suivant
+        self._workers = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    def notify(self):
+        """À appeler après la création d'un lot pour réveiller les workers inactifs."""
+        self._wakeup.set()
+
+    async def stop(self):
+        for w in self._workers: w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _next(self):
+        """Ticket suivant réservé après obtention de ses jetons (il reste « pending » pendant l'attente), ou None."""
+        async with self._dispatch:
+            job = self.store.next_pending()
+            if job is None: return None
+            job_id, ticket = job
+            try:
+                needed = list(self.providers(ticket))
+            except Exception:
+                needed = []  # ticket illisible : le runner remontera l'erreur sans consommer de quota
+            for name in needed:
+                if name in self.limiters: await self.limiters[name].acquire()
+            return job if self.store.claim(job_id) else None
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._next()
+            if job is None:
+                if self.store.next_pending() is not None: continue
+                self._wakeup.clear()
+                try:
+                    async with asyncio.timeout(self.poll):
+                        await self._wakeup.wait()
+                except TimeoutError:
+                    pass
+                continue
+            job_id, ticket = job
+            try:
+                html = await self.runner(ticket)
+                self.store.finish(job_id, result=html)
+            except asyncio.CancelledError:
+                raise
+            except IncompleteReport as e:
+                logger.warning("Ticket %s incomplet : %s", job_id, e)
+                self.store.finish(job_id, result=e.html, error=str(e))
+            except Exception as e:
+                logger.warning("Ticket %s en erreur : %s", job_id, e)
+                self.store.finish(job_id, error=str(e))
@@ -0,0 +1,160 @@
+"""Métriques au format Prometheus (histogrammes, compteurs) et détail par requête pour l'en-tête Server-Timing."""
+import asyncio
+import contextvars
+import resource
+import sys
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, le: str = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None: pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.values = defaultdict(float)
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        self.values[tuple(labels.get(n, "") for n in self.labels)] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, tuple(labels), tuple(buckets)
+        self.series = {}  # valeurs des labels -> [compte par seau (non cumulé)..., somme, total]
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self.series.get(key)
+        if series is None: series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip([f"{b:g}" for b in self.buckets] + ["+Inf"], series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Valeur lue au moment de l'export (fonction sans argument)."""
+
+    def __init__(self, name: str, doc: str, read):
+        self.name, self.doc, self.read = name, doc, read
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.read():g}"]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+REQUEST_SECONDS = Histogram("somfy_http_request_seconds", "Durée des requêtes HTTP (jusqu'aux en-têtes)",
+                            ("route", "method", "status"))
+STAGE_SECONDS = Histogram("somfy_stage_seconds", "Durée de chaque étape du diagnostic", ("stage",))
+STAGE_BYTES = Histogram("somfy_stage_bytes", "Volume de données traité par étape", ("stage",), BYTES_BUCKETS)
+STAGE_ERRORS = Counter("somfy_stage_errors_total", "Étapes en échec (error) ou interrompues par un délai (timeout)",
+                       ("stage", "kind"))
+TOKENS = Counter("somfy_llm_tokens_total", "Tokens facturés par les fournisseurs", ("provider", "kind"))
+UPSTREAM_SECONDS = Histogram("somfy_upstream_attempt_seconds", "Durée de chaque tentative d'appel fournisseur",
+                             ("provider", "outcome"))
+UPSTREAM_ERRORS = Counter("somfy_upstream_errors_total", "Échecs d'appel fournisseur par type", ("provider", "kind"))
+ADMISSION_WAIT = Histogram("somfy_admission_wait_seconds", "Attente avant admission d'un diagnostic", ("priority",))
+ADMISSION_SHED = Counter("somfy_admission_shed_total", "Diagnostics refusés (503) par le contrôle d'admission",
+                         ("reason", "priority"))
+
+LOOP_LAG = Histogram("somfy_event_loop_lag_seconds", "Retard de la boucle d'événements sur un réveil programmé",
+                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+# ru_maxrss : kilo-octets sous Linux, octets sous macOS
+PEAK_RSS = Gauge("somfy_process_peak_rss_bytes", "Mémoire résidente maximale du processus",
+                 lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024))
+
+
+async def watch_loop_lag(interval: float = 0.1):
+    """Tâche de fond : un code bloquant (CPU, I/O synchrone) retarde ce réveil d'autant."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
+
+# --- DÉTAIL PAR REQUÊTE (Server-Timing) ---
+_timings = contextvars.ContextVar("server_timing", default=None)
+
+
+def begin_request() -> list:
+    """Ouvre le relevé de la requête courante ; les tâches créées ensuite y écrivent aussi (contexte copié)."""
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def record(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None: timings.append((stage, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Chronomètre un bloc ; un délai dépassé (annulation par wait_for) est compté à part des erreurs."""
+    start = time.perf_counter()
+    try:
+        yield
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        STAGE_ERRORS.inc(stage=name, kind="timeout")
+        raise
+    except Exception:
+        STAGE_ERRORS.inc(stage=name, kind="error")
+        raise
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def count_bytes(stage: str, size: int):
+    STAGE_BYTES.observe(size, stage=stage)
+
+
+def count_tokens(provider: str, usage):
+    """Usage d'une réponse (objet SDK ou dict JSON) : tokens de prompt et générés."""
+    if not usage: return
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    for kind in ("prompt", "completion"):
+        n = get(f"{kind}_tokens")
+        if n: TOKENS.inc(n, provider=provider, kind=kind)
+
+
+def server_timing(timings: list) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
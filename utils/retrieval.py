@@ -0,0 +1,26 @@
+"""Sélection des produits pertinents à injecter dans le prompt, au lieu de toute la base."""
+from utils import somfy_database as db
+
+
+def top_k(description: str, reference: str = None, k: int = 3) -> list:
+    """Retourne [(référence, produit)] : la référence scannée d'abord, puis les meilleurs résultats de l'index."""
+    selected = []
+    if reference and db.get_product_by_ref(reference):
+        selected.append((reference, db.get_product_by_ref(reference)))
+    for ref, product, _ in db.search_products(description, k + len(selected)):
+        if len(selected) >= k: break
+        if ref != reference: selected.append((ref, product))
+    return selected
+
+
+def format_context(products: list) -> str:
+    """Fiche compacte (specs et raccordements, sans URL de documents) pour chaque produit retenu."""
+    if not products:
+        return "Aucun produit de la base ne correspond à la demande."
+    blocks = []
+    for ref, p in products:
+        blocks.append(
+            f"[{ref}] {p['name']} ({p['type']}) - Normes : {p['norms']}\n"
+            f"Caractéristiques :\n{p['specs']}\nRaccordements :\n{p['connections']}"
+        )
+    return "\n\n".join(blocks)
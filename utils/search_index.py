@@ -0,0 +1,108 @@
+"""Index de recherche du catalogue : tokens sans accents, préfixes, tolérance aux fautes de frappe, classement BM25."""
+import heapq
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+# Poids des champs (BM25F simplifié) : la référence et le nom priment sur les cas d'usage
+FIELD_WEIGHTS = {"ref": 5.0, "name": 3.0, "type": 2.0, "specs": 1.0, "connections": 1.0, "use_cases": 0.5, "norms": 0.5}
+STOPWORDS = {
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "ou", "en", "sur", "pour", "par", "avec", "sans",
+    "ne", "pas", "plus", "est", "sont", "il", "elle", "on", "au", "aux", "ce", "cette", "qui", "que", "se",
+    "reference", "ref", "produit", "panne", "probleme",
+}
+
+
+def tokenize(text: str) -> list:
+    """Mots en minuscules sans accents (au moins 2 caractères, hors mots vides)."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return [t for t in re.findall(r"[a-z0-9+]+", text) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _is_reference(token: str) -> bool:
+    return len(token) >= 4 and any(c.isdigit() for c in token)
+
+
+def _deletes(token: str) -> set:
+    """Variantes à une suppression près (index « symmetric delete » pour la distance d'édition 1)."""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class ProductIndex:
+    """Index inversé construit une seule fois ; les postings sont triés par impact BM25 décroissant.
+
+    Les impacts ne dépendant que du document, ils sont précalculés. Une requête parcourt d'abord les termes
+    rares (au plus max_postings postings chacun) ; les termes fréquents ne font ensuite que compléter le score
+    des candidats déjà trouvés, par simple consultation de dictionnaire.
+    """
+
+    def __init__(self, products: dict, k1: float = 1.2, b: float = 0.75, max_postings: int = 500):
+        self.products = products
+        self.max_postings = max_postings
+        tfs = {}
+        lengths = {}
+        df = Counter()
+        for ref, product in products.items():
+            tf = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                value = ref if field == "ref" else product.get(field, "")
+                for tok in tokenize(str(value)):
+                    tf[tok] += weight
+            tfs[ref] = tf
+            lengths[ref] = sum(tf.values())
+            df.update(tf.keys())
+
+        n = max(len(products), 1)
+        avgdl = (sum(lengths.values()) / n) or 1.0
+        postings = defaultdict(list)
+        for ref, tf in tfs.items():
+            norm = k1 * (1 - b + b * lengths[ref] / avgdl)
+            for tok, f in tf.items():
+                idf = math.log(1 + (n - df[tok] + 0.5) / (df[tok] + 0.5))
+                postings[tok].append((idf * f * (k1 + 1) / (f + norm), ref))
+        self.postings = {tok: sorted(plist, reverse=True) for tok, plist in postings.items()}
+        self.impacts = {tok: {ref: impact for impact, ref in plist}
+                        for tok, plist in self.postings.items() if len(plist) > max_postings}
+        self.vocabulary = sorted(self.postings)
+
+        # Fautes de frappe : seulement pour les références (saisies à la main, souvent à un chiffre près)
+        self.deletes = defaultdict(set)
+        for tok in self.vocabulary:
+            if _is_reference(tok):
+                for variant in _deletes(tok) | {tok}:
+                    self.deletes[variant].add(tok)
+
+    def expand(self, token: str, max_terms: int = 20) -> list:
+        """Termes de l'index correspondant au token : [(terme, facteur)], exact > préfixe > faute de frappe."""
+        if token in self.postings:
+            return [(token, 1.0)]
+        terms = []
+        i = bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and len(terms) < max_terms and self.vocabulary[i].startswith(token):
+            terms.append((self.vocabulary[i], 0.8))
+            i += 1
+        if not terms and _is_reference(token):
+            candidates = set()
+            for variant in _deletes(token) | {token}:
+                candidates |= self.deletes.get(variant, set())
+            terms = [(t, 0.6) for t in sorted(candidates)[:max_terms]]
+        return terms
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Retourne les k meilleurs [(référence, score)]."""
+        scores = defaultdict(float)
+        terms = [(term, factor) for tok in set(tokenize(query)) for term, factor in self.expand(tok)]
+        terms.sort(key=lambda item: len(self.postings[item[0]]))
+        for term, factor in terms:
+            if scores and term in self.impacts:
+                impacts = self.impacts[term]
+                for ref in scores:
+                    impact = impacts.get(ref)
+                    if impact: scores[ref] += factor * impact
+            else:
+                for impact, ref in self.postings[term][:self.max_postings]:
+                    scores[ref] += factor * impact
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
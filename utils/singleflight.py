@@ -0,0 +1,58 @@
+"""Coalescence des diagnostics identiques en cours : un seul calcul amont, partagé par toutes les requêtes."""
+import asyncio
+
+
+def _expire(fut: asyncio.Future):
+    if not fut.done(): fut.set_exception(TimeoutError("calcul partagé expiré"))
+
+
+def _transfer(task: asyncio.Task, fut: asyncio.Future):
+    if fut.done(): return
+    if task.cancelled(): fut.set_exception(asyncio.CancelledError())
+    elif task.exception(): fut.set_exception(task.exception())
+    else: fut.set_result(task.result())
+
+
+class SingleFlight:
+    """Une future par clé en vol ; les requêtes suivantes attendent le résultat du « meneur »."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key: str):
+        """Future du calcul en cours pour cette clé (protégée contre l'annulation d'un suiveur), ou None."""
+        fut = self._inflight.get(key)
+        if fut is None: return None
+        self.followers += 1
+        return asyncio.shield(fut)
+
+    def begin(self, key: str, ttl: float) -> asyncio.Future:
+        """Déclare un calcul ; l'appelant doit résoudre la future. Passé `ttl` s, elle échoue en TimeoutError."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._inflight[key] = fut
+        self.leaders += 1
+        timer = loop.call_later(ttl, _expire, fut)
+        # Exception marquée comme lue : sans suiveur, asyncio journaliserait « Future exception was never retrieved »
+        fut.add_done_callback(lambda f: (timer.cancel(), self._inflight.pop(key, None), f.cancelled() or f.exception()))
+        return fut
+
+    async def do(self, key: str, make_coro, ttl: float):
+        """Exécute make_coro() une seule fois par clé en vol ; retourne (résultat, partagé)."""
+        pending = self.join(key)
+        if pending is not None:
+            try:
+                return await pending, True
+            except TimeoutError:
+                pass  # calcul partagé expiré ou en échec sur un délai : on repart sur un calcul propre
+        fut = self.begin(key, ttl)
+        task = asyncio.ensure_future(make_coro())
+        # Le calcul survit à l'annulation du meneur : les suiveurs en ont encore besoin
+        task.add_done_callback(lambda t: _transfer(t, fut))
+        # Le meneur attend son propre calcul : l'expiration (ttl) ne fait que libérer les suiveurs
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "upstream_calls_saved": self.followers}
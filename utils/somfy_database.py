@@ -1,5 +1,12 @@
 """Base de données Somfy - Produits & Documentation"""
 
+import os
+
+from utils.search_index import ProductIndex
+
+# Catalogue complet sur SQLite si SOMFY_CATALOGUE_DB est défini ; le dictionnaire ci-dessous sert alors de graine
+CATALOGUE_DB = os.environ.get("SOMFY_CATALOGUE_DB", "")
+
 SOMFY_PRODUCTS = {
     "1810392": {
         "name": "Animeo Switch Zone Splitter",
@@ -50,14 +57,30 @@ SOMFY_PRODUCTS = {
     },
 }
 
+if CATALOGUE_DB:
+    from utils.catalogue import CatalogueStore
+    STORE = CatalogueStore(CATALOGUE_DB, seed=SOMFY_PRODUCTS, cache_size=int(os.environ.get("SOMFY_CATALOGUE_CACHE", "2048")))
+    PRODUCT_INDEX = None
+else:
+    STORE = None
+    # Index construit une seule fois au chargement du module
+    PRODUCT_INDEX = ProductIndex(SOMFY_PRODUCTS)
+
 def get_product_by_ref(reference: str):
     """Retourne les infos produit par référence."""
+    if STORE: return STORE.get(reference) or SOMFY_PRODUCTS.get(reference)
     return SOMFY_PRODUCTS.get(reference)
 
-def search_products_by_keyword(keyword: str):
-    """Cherche des produits par mot-clé."""
-    results = []
-    for ref, product in SOMFY_PRODUCTS.items():
-        if keyword.lower() in product["name"].lower() or keyword.lower() in product["type"].lower():
-            results.append((ref, product))
-    return results
+def list_references(limit: int = 20):
+    """Premières références du catalogue (pour les messages d'aide)."""
+    if STORE: return STORE.references(limit)
+    return list(SOMFY_PRODUCTS)[:limit]
+
+def search_products(query: str, k: int = 10):
+    """Recherche classée (BM25) : retourne [(référence, produit, score)]."""
+    if STORE: return STORE.search(query, k)
+    return [(ref, SOMFY_PRODUCTS[ref], score) for ref, score in PRODUCT_INDEX.search(query, k)]
+
+def search_products_by_keyword(keyword: str, k: int = 10):
+    """Cherche des produits par mot-clé (accents, casse, préfixes et fautes de frappe tolérés), du plus pertinent au moins pertinent."""
+    return [(ref, product) for ref, product, _ in search_products(keyword, k)]
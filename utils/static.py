@@ -0,0 +1,41 @@
+"""Ressources statiques de la PWA rendues une fois au démarrage : précompressées, ETag fort, réponses 304."""
+import gzip
+import hashlib
+
+from fastapi import Request, Response
+
+try:
+    import brotli  # optionnel : pip install brotli
+except ImportError:
+    brotli = None
+
+
+class StaticAsset:
+    """Contenu figé et ses variantes compressées ; `response(request)` négocie l'encodage et gère If-None-Match."""
+
+    def __init__(self, content: bytes, media_type: str, cache_control: str = "no-cache"):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(content).hexdigest()[:20] + '"'
+        self.variants = {"identity": content, "gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(content, quality=11)
+
+    def encoding_for(self, accept_encoding: str) -> str:
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted: return encoding
+        return "identity"
+
+    def response(self, request: Request) -> Response:
+        # ETag unique pour toutes les variantes : le contenu décodé est identique (Vary protège les caches partagés)
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        match = request.headers.get("if-none-match", "")
+        if match.strip() == "*" or self.etag in [tag.strip().removeprefix("W/") for tag in match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        encoding = self.encoding_for(request.headers.get("accept-encoding", ""))
+        if encoding != "identity": headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {encoding: len(body) for encoding, body in self.variants.items()}
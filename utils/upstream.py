@@ -0,0 +1,298 @@
+"""Accès partagé aux fournisseurs externes (Groq, Perplexity) pour l'application et les agents.
+
+Chaque fournisseur passe par une couche de résilience commune : limitation de débit par clé d'API,
+reprises avec backoff aléatoire sur 429/5xx/timeouts, requêtes doublées (hedging) optionnelles pour
+la latence de queue et disjoncteur qui court-circuite un fournisseur en échec répété.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from groq import APIConnectionError as GroqConnectionError
+
+from utils import metrics
+
+PERPLEXITY_URL = os.environ.get("PERPLEXITY_URL", "https://api.perplexity.ai/chat/completions")
+PERPLEXITY_MODEL = os.environ.get("PERPLEXITY_MODEL", "sonar-pro")
+PERPLEXITY_SYSTEM = "Expert technique Somfy. Donne des solutions précises, schémas ou codes erreurs. Sois concis et utilise le gras."
+
+logger = logging.getLogger(__name__)
+
+# Client HTTP keep-alive partagé, créé et fermé par le lifespan de l'application
+http_client: httpx.AsyncClient = None
+
+
+class TokenBucket:
+    """Limiteur de débit : `rate` requêtes par seconde en moyenne, rafales jusqu'à `burst`."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, rpm: float, burst: float = 1.0):
+        """None si rpm <= 0 (pas de limite)."""
+        return cls(rpm / 60.0, burst) if rpm > 0 else None
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class UpstreamError(Exception):
+    """Fournisseur non configuré ou réponse inexploitable."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Disjoncteur ouvert : le fournisseur est ignoré jusqu'à `retry_in` secondes."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} désactivé temporairement après des échecs répétés (nouvel essai dans {retry_in:.0f} s)")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Fermé -> ouvert après `threshold` échecs consécutifs ; une seule requête d'essai après `reset_after` s."""
+
+    def __init__(self, name: str, threshold: int = 5, reset_after: float = 30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def check(self) -> bool:
+        """Lève CircuitOpenError si l'appel doit être ignoré ; True si cet appel est la requête d'essai."""
+        if self.opened_at is None: return False
+        elapsed = time.monotonic() - self.opened_at
+        if elapsed < self.reset_after or self._probing:
+            raise CircuitOpenError(self.name, max(self.reset_after - elapsed, 0))
+        self._probing = True
+        return True
+
+    def end_probe(self):
+        """Requête d'essai terminée sans verdict (annulée, erreur 4xx) : la suivante pourra réessayer."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None: logger.warning("Disjoncteur %s ouvert après %d échecs", self.name, self.failures)
+            self.opened_at = time.monotonic()
+
+
+def status_code(exc: Exception):
+    """Code HTTP porté par une erreur httpx ou SDK Groq, sinon None."""
+    code = getattr(exc, "status_code", None)
+    if code is None and getattr(exc, "response", None) is not None:
+        code = getattr(exc.response, "status_code", None)
+    return code
+
+
+def is_retryable(exc: Exception) -> bool:
+    code = status_code(exc)
+    if code is not None: return code == 429 or code >= 500
+    # Timeouts et coupures réseau (httpx, ou SDK Groq dont APITimeoutError dérive de APIConnectionError)
+    return isinstance(exc, (asyncio.TimeoutError, httpx.TransportError, GroqConnectionError))
+
+
+def error_kind(exc: Exception) -> str:
+    """Catégorie d'échec pour les métriques : timeout, rate_limited, http_5xx, http_4xx, network ou other."""
+    if isinstance(exc, asyncio.TimeoutError): return "timeout"
+    code = status_code(exc)
+    if code == 429: return "rate_limited"
+    if code is not None: return "http_5xx" if code >= 500 else "http_4xx"
+    if isinstance(exc, (httpx.TransportError, GroqConnectionError)): return "network"
+    return "other"
+
+
+def retry_after(exc: Exception):
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class Provider:
+    """Enveloppe résiliente autour des appels à un fournisseur ; `call(make_request)` relance la coroutine fournie."""
+
+    def __init__(self, name: str, rpm: float = 0, retries: int = 2, backoff: float = 0.5, backoff_max: float = 8.0,
+                 attempt_timeout: float = 30.0, hedge_after: float = 0, breaker_threshold: int = 5,
+                 breaker_reset: float = 30.0):
+        self.name = name
+        self.rpm = rpm
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(name, breaker_threshold, breaker_reset)
+        self._buckets = {}  # clé d'API -> TokenBucket
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0, "hedges": 0, "short_circuits": 0}
+
+    @classmethod
+    def from_env(cls, name: str, **defaults):
+        """Paramètres surchargés par <NOM>_RPM, <NOM>_RETRIES, <NOM>_ATTEMPT_TIMEOUT, <NOM>_HEDGE_AFTER, ..."""
+        prefix = name.upper()
+        env = {
+            "rpm": ("RPM", float), "retries": ("RETRIES", int), "attempt_timeout": ("ATTEMPT_TIMEOUT", float),
+            "hedge_after": ("HEDGE_AFTER", float), "breaker_threshold": ("BREAKER_THRESHOLD", int),
+            "breaker_reset": ("BREAKER_RESET", float),
+        }
+        params = dict(defaults)
+        for arg, (suffix, cast) in env.items():
+            value = os.environ.get(f"{prefix}_{suffix}")
+            if value: params[arg] = cast(value)
+        return cls(name, **params)
+
+    async def _limit(self, api_key: str):
+        if self.rpm <= 0: return
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket.per_minute(self.rpm, burst=max(self.rpm / 60, 1))
+        await bucket.acquire()
+
+    async def _attempt(self, make_request):
+        async with asyncio.timeout(self.attempt_timeout):
+            return await make_request()
+
+    async def _hedged(self, make_request, api_key: str):
+        """Lance une seconde requête identique si la première n'a pas répondu après hedge_after s ; garde la plus rapide."""
+        if self.hedge_after <= 0:
+            return await self._attempt(make_request)
+        first = asyncio.create_task(self._attempt(make_request))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done: return first.result()
+            # La requête doublée compte dans le débit autorisé ; si la première répond pendant l'attente du jeton, on s'arrête
+            token = asyncio.create_task(self._limit(api_key))
+            await asyncio.wait({first, token}, return_when=asyncio.FIRST_COMPLETED)
+            if first.done():
+                token.cancel()
+                return first.result()
+            self.stats["hedges"] += 1
+            tasks.add(asyncio.create_task(self._attempt(make_request)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None: return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks: task.cancel()
+
+    async def call(self, make_request, api_key: str = ""):
+        try:
+            probe = self.breaker.check()
+        except CircuitOpenError:
+            self.stats["short_circuits"] += 1
+            metrics.UPSTREAM_ERRORS.inc(provider=self.name, kind="circuit_open")
+            raise
+        try:
+            return await self._call(make_request, api_key)
+        finally:
+            # Essai annulé (budget, déconnexion) ou refusé en 4xx : sans ce verrou rendu, le disjoncteur resterait ouvert
+            if probe: self.breaker.end_probe()
+
+    async def _call(self, make_request, api_key: str):
+        self.stats["calls"] += 1
+        attempt = 0
+        try:
+            while True:
+                await self._limit(api_key)
+                start = time.perf_counter()
+                try:
+                    result = await self._hedged(make_request, api_key)
+                    metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, provider=self.name, outcome="ok")
+                    self.breaker.record_success()
+                    return result
+                except Exception as e:
+                    metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, provider=self.name, outcome="error")
+                    metrics.UPSTREAM_ERRORS.inc(provider=self.name, kind=error_kind(e))
+                    if isinstance(e, asyncio.TimeoutError): self.stats["timeouts"] += 1
+                    if not is_retryable(e):
+                        # Erreur de requête (400, 401...) : le fournisseur répond, ce n'est pas une panne
+                        self.stats["failures"] += 1
+                        raise
+                    if attempt >= self.retries:
+                        self.stats["failures"] += 1
+                        self.breaker.record_failure()
+                        raise
+                    attempt += 1
+                    self.stats["retries"] += 1
+                    # Backoff exponentiel à gigue complète, ou délai imposé par Retry-After
+                    delay = retry_after(e) or random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+                    logger.info("%s : nouvel essai %d/%d dans %.2f s (%s)", self.name, attempt, self.retries, delay, e)
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # Délai de l'étape atteint pendant une reprise : le fournisseur a déjà échoué dans cet appel
+            if attempt:
+                self.stats["failures"] += 1
+                self.breaker.record_failure()
+            raise
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "circuit": self.breaker.state}
+
+
+# Tentatives à ~40 % du délai de l'étape (GROQ_DEADLINE / WEB_DEADLINE) : une reprise tient dans l'étape
+groq = Provider.from_env("groq", rpm=0, retries=2, attempt_timeout=12.0)
+perplexity = Provider.from_env("perplexity", rpm=0, retries=2, attempt_timeout=10.0)
+
+
+async def call_perplexity(prompt: str, system: str = PERPLEXITY_SYSTEM) -> str:
+    """Envoie un prompt à Perplexity via le pool partagé et retourne le texte de la réponse."""
+    api_key = os.environ.get("PERPLEXITY_API_KEY")
+    if not api_key: raise UpstreamError("PERPLEXITY_API_KEY non configurée")
+    if http_client is None: raise UpstreamError("client HTTP non initialisé")
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    data = {
+        "model": PERPLEXITY_MODEL,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+    async def request():
+        res = await http_client.post(PERPLEXITY_URL, json=data, headers=headers)
+        res.raise_for_status()
+        return res
+
+    res = await perplexity.call(request, api_key)
+    metrics.count_bytes("perplexity_response", len(res.content))
+    try:
+        body = res.json()
+        metrics.count_tokens("perplexity", body.get("usage"))
+        return body['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError) as e:
+        raise UpstreamError(f"réponse Perplexity inattendue : {e}") from e